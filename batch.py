@@ -0,0 +1,219 @@
+"""
+batch.py
+~~~~~~~~
+
+Answers a stream of questions from the command line.  Questions are
+read one per line from a file or from stdin, either as plain text or
+as JSON objects with a "question" field.  Results are written as JSON
+lines, one per question, as soon as each question is answered, so
+the output is in order of completion, not of input.
+
+Example:
+
+    python batch.py -s hybrid -c 8 -o answers.jsonl questions.txt
+
+Only a few questions per worker are held in memory at once, so
+arbitrarily long inputs can be processed.  With `--resume`, questions
+already answered in the output file are skipped, and new results are
+appended to it.
+"""
+
+#### Library imports
+import mini_qa
+
+# Standard library
+import argparse
+import hashlib
+import json
+import os
+import Queue
+import sys
+import threading
+import time
+
+
+def main():
+    args = parse_args()
+    source = args.source
+    done = set()
+    if args.resume and args.output and os.path.exists(args.output):
+        done = answered_questions(args.output, source)
+    infile = open(args.input) if args.input else sys.stdin
+    if args.output:
+        outfile = open(args.output, "a" if args.resume else "w")
+    else:
+        outfile = sys.stdout
+    try:
+        for result in answer_stream(
+                questions(infile, source, done), source, args.concurrency,
+                args.num, args.timeout):
+            outfile.write(json.dumps(result)+"\n")
+            outfile.flush()
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Answer questions read one per line, writing JSON "
+        "lines.")
+    parser.add_argument("input", nargs="?",
+                        help="file of questions (default: stdin)")
+    parser.add_argument("-o", "--output",
+                        help="file to write results to (default: stdout)")
+    parser.add_argument("-s", "--source", default="google",
+                        choices=["google", "wolfram", "hybrid", "auto"])
+    parser.add_argument("-c", "--concurrency", type=int, default=4,
+                        help="number of questions answered at once")
+    parser.add_argument("-n", "--num", type=int, default=20,
+                        help="number of Google answers to output")
+    parser.add_argument("-t", "--timeout", type=float, default=None,
+                        help="time budget in seconds for each question")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip questions already in the output file, "
+                        "and append to it")
+    return parser.parse_args()
+
+def question_digest(question, source):
+    """
+    Return a short digest identifying `question` asked of `source`.
+    Storing digests rather than questions keeps the memory needed to
+    resume small.
+    """
+    return hashlib.md5(
+        ("%s\n%s" % (source, question)).encode("utf-8")).digest()
+
+def answered_questions(filename, source):
+    """
+    Return the set of digests of the questions answered from `source`
+    in the results file `filename`, without error or timing out.
+    """
+    done = set()
+    with open(filename) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError: # e.g., a truncated last line
+                continue
+            if (result.get("source") == source and "error" not in result
+                and not result.get("timed_out")):
+                done.add(question_digest(result["question"], source))
+    return done
+
+def questions(infile, source, done=frozenset()):
+    """
+    Generate the questions in `infile`, skipping blank lines and
+    questions whose digests are in `done`.  Lines which can't be read
+    are reported on stderr, and skipped.
+    """
+    for (j, line) in enumerate(infile):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if line.startswith("{"):
+                question = json.loads(line)["question"]
+            else:
+                question = line.decode("utf-8")
+        except (ValueError, KeyError, TypeError) as e:
+            sys.stderr.write("Skipping line %s: %s: %s\n" % (
+                j+1, type(e).__name__, e))
+            continue
+        if question_digest(question, source) not in done:
+            yield question
+
+def answer_stream(questions, source="google", concurrency=4, num=20,
+                  timeout=None):
+    """
+    Generate result dicts for each of `questions`, answered from
+    `source` by `concurrency` worker threads.  Results are generated
+    as soon as they're ready.  At most about `2*concurrency` questions
+    are in flight at any time.  If generating `questions` raises an
+    exception, it's re-raised once the questions already read have
+    been answered.
+    """
+    pending = Queue.Queue(maxsize=2*concurrency)
+    results = Queue.Queue(maxsize=2*concurrency)
+    errors = []
+    def feed():
+        try:
+            for question in questions:
+                pending.put(question)
+        except Exception:
+            errors.append(sys.exc_info())
+        finally:
+            for _ in range(concurrency):
+                pending.put(None)
+    def work():
+        while True:
+            question = pending.get()
+            if question is None:
+                results.put(None)
+                return
+            results.put(answer(question, source, num, timeout))
+    threads = [threading.Thread(target=feed)] + [
+        threading.Thread(target=work) for _ in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    finished = 0
+    while finished < concurrency:
+        result = results.get()
+        if result is None:
+            finished += 1
+        else:
+            yield result
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+def answer(question, source="google", num=20, timeout=None):
+    """
+    Return a dict describing the answer to `question` from `source`,
+    suitable for writing as a JSON line.  Errors are reported in the
+    dict rather than raised, as are failed upstream calls, so that the
+    question is answered again when the batch is resumed.
+    """
+    result = {"question": question, "source": source}
+    mini_qa.reset_cache_stats()
+    mini_qa.reset_upstream_errors()
+    start = time.time()
+    deadline = None if timeout is None else start + timeout
+    try:
+        answers = mini_qa.qa(question, source, deadline)
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    else:
+        if source == "google":
+            result["answers"] = [text for (text, score) in answers[:num]]
+            result["scores"] = [score for (text, score) in answers[:num]]
+        else:
+            result["answer"] = answers or None
+        result["timed_out"] = mini_qa.timed_out(answers)
+        failures = sorted(
+            (name, count)
+            for (name, count) in mini_qa.upstream_errors.counts.items()
+            if count)
+        if failures:
+            result["error"] = "UpstreamError: %s" % ", ".join(
+                "%s x%d" % failure for failure in failures)
+    result["seconds"] = round(time.time()-start, 3)
+    result["cache"] = cache_status()
+    return result
+
+def cache_status():
+    """
+    Return "hit" if every cache lookup made by the current thread
+    since the stats were reset was a hit, "miss" if every lookup
+    missed, "none" if there were no lookups, and "partial"
+    otherwise.
+    """
+    hits = mini_qa.cache_stats.hits
+    misses = mini_qa.cache_stats.misses
+    if misses == 0:
+        return "hit" if hits else "none"
+    return "miss" if hits == 0 else "partial"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+bloom.py
+~~~~~~~~
+
+A simple Bloom filter, used to remember which keys are in a cache.
+If the filter says a key is absent, it's definitely absent (provided
+the filter has seen every key added to the cache), and we can skip
+asking the cache.  If it says a key is present, it's probably present.
+The probability of a false positive stays below `error_rate` as long
+as no more than `capacity` keys are added.
+"""
+
+#### Library imports
+
+# Standard library
+import hashlib
+import math
+import os
+import struct
+import threading
+
+
+class BloomFilter():
+    """
+    A Bloom filter sized to hold `capacity` keys with a false positive
+    rate of at most `error_rate`.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.num_bits = int(math.ceil(
+            -capacity*math.log(error_rate)/math.log(2)**2))
+        self.num_hashes = max(1, int(round(
+            self.num_bits/float(capacity)*math.log(2))))
+        self.bits = bytearray((self.num_bits+7)//8)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def positions(self, key):
+        """
+        Return the positions of the bits for `key`, using double
+        hashing on an MD5 digest.
+        """
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(key).digest())
+        return [(h1+j*h2) % self.num_bits for j in xrange(self.num_hashes)]
+
+    def add(self, key):
+        """
+        Add `key` to the filter.
+        """
+        positions = self.positions(key)
+        with self.lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(key))
+
+    def save(self, filename):
+        """
+        Save the filter to `filename`.  The file is replaced
+        atomically, so readers never see a partly written filter.
+        """
+        temp = "%s.%s.tmp" % (filename, os.getpid())
+        with self.lock:
+            with open(temp, "wb") as f:
+                f.write("BLOOM1 %s %s %s\n" % (
+                    self.num_bits, self.num_hashes, self.count))
+                f.write(self.bits)
+        os.rename(temp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Return the filter saved in `filename`.
+        """
+        with open(filename, "rb") as f:
+            magic, num_bits, num_hashes, count = f.readline().split()
+            if magic != "BLOOM1":
+                raise ValueError("%s is not a saved Bloom filter" % filename)
+            bloom_filter = cls(1)
+            bloom_filter.num_bits = int(num_bits)
+            bloom_filter.num_hashes = int(num_hashes)
+            bloom_filter.count = int(count)
+            bloom_filter.bits = bytearray(f.read())
+        return bloom_filter
@@ -0,0 +1,394 @@
+"""
+cache.py
+~~~~~~~~
+
+S3-backed caches for the results of Google and Wolfram Alpha queries,
+and a small in-memory LRU cache.
+
+Each entry is stored as a JSON document, with S3 metadata recording
+the format version, the time the entry was created, and
+(approximately) the time it was last accessed.  Access times are only
+rewritten when they're more than `ACCESS_RESOLUTION` seconds out of
+date, so reads rarely cause writes.  Entries written by older versions
+of `mini_qa` were pickled, and had no metadata.  We can still read
+them, and `compact` rewrites them in the current format.
+
+A cache may keep a Bloom filter of its keys in a local file.  When the
+filter says a key is absent, we skip the round trip to S3.  Keys added
+by other machines aren't in our filter, which just means we fetch (and
+cache) those results again, so the filter should be synced from the
+bucket listing regularly, with the "sync-filter" command.
+
+A cache may also be backed by a read-only snapshot (see
+`snapshot.py`), which is consulted before S3.
+
+Run as a script to maintain the caches.  For example:
+
+    python cache.py google expire --ttl-days 30
+    python cache.py wolfram evict --budget-mb 500
+    python cache.py google compact --workers 16
+    python cache.py google sync-filter
+"""
+
+#### Library imports
+
+# Standard library
+import argparse
+import atexit
+import calendar
+import cPickle as pickle
+from collections import namedtuple, OrderedDict
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+
+# Third-party libraries
+import boto
+import boto.utils
+from boto.s3.key import Key
+
+# My libraries
+from bloom import BloomFilter
+
+
+#### Version of the format used to store entries.  Entries without a
+#### version are legacy pickled entries.
+FORMAT_VERSION = 1
+
+#### Only update an entry's access time if the recorded time is more
+#### than this many seconds old
+ACCESS_RESOLUTION = 24*60*60
+
+#### When syncing a cache's Bloom filter, size it for this many times
+#### the number of keys currently in the cache, so it has room to grow
+FILTER_HEADROOM = 2
+
+#### False positive rate of the Bloom filters
+FILTER_ERROR_RATE = 0.01
+
+
+#### Description of a cache entry, as used for maintenance.  `created`
+#### and `accessed` are times, as returned by `time.time()`, and
+#### `version` is None for legacy entries
+Entry = namedtuple("Entry", "name size created accessed version")
+
+
+class Cache():
+    """
+    A cache of JSON-serializable values, stored in the S3 bucket
+    `bucket`.  `legacy_decoder` converts an unpickled legacy value
+    into the corresponding JSON-serializable value.  If the file
+    `filter_path` exists, it holds a Bloom filter of the keys in the
+    cache, which is used to skip lookups of absent keys.  If
+    `snapshot` is given, it's a snapshot.Snapshot holding entries for
+    this cache under the name `name`, which are used in preference to
+    S3.
+    """
+
+    def __init__(self, bucket, legacy_decoder=None, filter_path=None,
+                 name=None, snapshot=None):
+        self.bucket = bucket
+        self.legacy_decoder = legacy_decoder
+        self.filter_path = filter_path
+        self.name = name
+        self.snapshot = snapshot
+        self.filter = None
+        if filter_path and os.path.exists(filter_path):
+            self.filter = BloomFilter.load(filter_path)
+            atexit.register(self.save_filter)
+
+    def get(self, name):
+        """
+        Return the value cached under `name`.  Raises KeyError if
+        there's no such entry.  This takes a single round trip to S3,
+        or none if the entry is in the snapshot, or the Bloom filter
+        shows the entry is absent.
+        """
+        if self.snapshot is not None:
+            try:
+                return self.snapshot.get(self.name, name)
+            except KeyError:
+                pass
+        if self.filter is not None and name not in self.filter:
+            raise KeyError(name)
+        return self.fetch(name)
+
+    def fetch(self, name, touch=True):
+        """
+        Return the value stored in S3 under `name`, ignoring the
+        snapshot and Bloom filter.  Raises KeyError if there's no such
+        entry.  The entry's access time is updated only if `touch` is
+        true, so bulk reads don't hold off eviction.
+        """
+        key = Key(self.bucket, name)
+        try:
+            contents = key.get_contents_as_string()
+        except boto.exception.S3ResponseError as e:
+            if e.status == 404:
+                raise KeyError(name)
+            raise
+        if key.get_metadata("format-version") is None:
+            return self.decode_legacy(contents)
+        accessed = float(key.get_metadata("accessed") or 0)
+        if touch and time.time()-accessed > ACCESS_RESOLUTION:
+            touch = threading.Thread(target=self.touch, args=(key,))
+            touch.daemon = True
+            touch.start()
+        return json.loads(contents)["value"]
+
+    def set(self, name, value, created=None, accessed=None):
+        """
+        Cache `value` under `name`.  `created` and `accessed` are the
+        creation and access times to record, defaulting to now.
+        """
+        now = time.time()
+        key = Key(self.bucket, name)
+        key.set_metadata("format-version", str(FORMAT_VERSION))
+        key.set_metadata("created", repr(created or now))
+        key.set_metadata("accessed", repr(accessed or now))
+        key.set_contents_from_string(json.dumps({"value": value}))
+        if self.filter is not None:
+            self.filter.add(name)
+
+    def decode_legacy(self, contents):
+        """
+        Return the value stored in the legacy pickled `contents`.
+        """
+        value = pickle.loads(contents)
+        if self.legacy_decoder:
+            value = self.legacy_decoder(value)
+        return value
+
+    def touch(self, key):
+        """
+        Record that the entry `key` was just accessed, by copying it
+        in place with updated metadata.
+        """
+        metadata = dict(key.metadata)
+        metadata["accessed"] = repr(time.time())
+        try:
+            key.copy(self.bucket.name, key.name, metadata=metadata,
+                     preserve_acl=True)
+        except boto.exception.S3ResponseError:
+            pass # Not worth failing a read over
+
+    def sync_filter(self):
+        """
+        Rebuild the Bloom filter from the bucket listing, save it to
+        `filter_path`, and start using it.  Return the number of keys
+        in the filter.
+        """
+        names = [key.name for key in self.bucket.list()]
+        bloom_filter = BloomFilter(FILTER_HEADROOM*len(names),
+                                   FILTER_ERROR_RATE)
+        for name in names:
+            bloom_filter.add(name)
+        bloom_filter.save(self.filter_path)
+        if self.filter is None:
+            atexit.register(self.save_filter)
+        self.filter = bloom_filter
+        return len(names)
+
+    def save_filter(self):
+        """
+        Save the Bloom filter, including keys added since it was
+        loaded.
+        """
+        if self.filter is not None:
+            self.filter.save(self.filter_path)
+
+    def entries(self, workers=8):
+        """
+        Return a list of Entry instances describing every entry in the
+        cache.  Reading the metadata takes a request per entry, which
+        are made by `workers` threads in parallel.
+        """
+        keys = list(self.bucket.list())
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(self.entry, keys, chunksize=64)
+        finally:
+            pool.close()
+
+    def entry(self, listed_key):
+        """
+        Return an Entry describing `listed_key`, as returned by a bucket
+        listing.
+        """
+        key = self.bucket.get_key(listed_key.name)
+        modified = boto.utils.parse_ts(listed_key.last_modified)
+        modified = calendar.timegm(modified.utctimetuple())
+        created = float(key.get_metadata("created") or modified)
+        accessed = float(key.get_metadata("accessed") or created)
+        version = key.get_metadata("format-version")
+        return Entry(listed_key.name, listed_key.size, created, accessed,
+                     int(version) if version else None)
+
+    def etag(self, name):
+        """
+        Return the ETag of the entry `name`, a hash of its contents, or
+        None if there's no such entry.
+        """
+        key = self.bucket.get_key(name)
+        return key.etag if key else None
+
+    def delete(self, names):
+        """
+        Delete the entries with the given `names`.
+        """
+        names = list(names)
+        for j in xrange(0, len(names), 1000):
+            self.bucket.delete_keys(names[j:j+1000], quiet=True)
+
+    def expire(self, ttl, workers=8):
+        """
+        Delete all entries created more than `ttl` seconds ago.
+        Return the number of entries deleted.
+        """
+        cutoff = time.time()-ttl
+        expired = [entry.name for entry in self.entries(workers)
+                   if entry.created < cutoff]
+        self.delete(expired)
+        return len(expired)
+
+    def evict(self, budget, workers=8):
+        """
+        Delete the least recently accessed entries, until the total
+        size of the cache is at most `budget` bytes.  Return the number
+        of entries deleted.
+        """
+        entries = sorted(self.entries(workers), key=lambda e: e.accessed)
+        size = sum(entry.size for entry in entries)
+        evicted = []
+        for entry in entries:
+            if size <= budget:
+                break
+            evicted.append(entry.name)
+            size -= entry.size
+        self.delete(evicted)
+        return len(evicted)
+
+    def compact(self, workers=8):
+        """
+        Rewrite all legacy entries in the current format, keeping their
+        creation and access times.  Return the number of entries rewritten.
+        """
+        legacy = [entry for entry in self.entries(workers)
+                  if entry.version != FORMAT_VERSION]
+        def rewrite(entry):
+            value = self.fetch(entry.name, touch=False)
+            self.set(entry.name, value, created=entry.created,
+                     accessed=entry.accessed)
+        pool = ThreadPool(workers)
+        try:
+            pool.map(rewrite, legacy, chunksize=16)
+        finally:
+            pool.close()
+        return len(legacy)
+
+
+class LRUCache():
+    """
+    An in-memory cache holding values of total size at most `size`,
+    discarding the least recently used values first.  The size of a
+    value is given by the function `sizeof`, and is 1 by default, so
+    `size` limits the number of values.  Safe to use from several
+    threads.
+    """
+
+    def __init__(self, size, sizeof=None):
+        self.size = size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.entries = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the value cached under `key`.  Raises KeyError if
+        there's no such value.
+        """
+        with self.lock:
+            (value, value_size) = self.entries.pop(key)
+            self.entries[key] = (value, value_size)
+            return value
+
+    def set(self, key, value):
+        """
+        Cache `value` under `key`, unless it's bigger than the whole
+        cache.
+        """
+        value_size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.total -= self.entries.pop(key)[1]
+            if value_size > self.size:
+                return
+            self.entries[key] = (value, value_size)
+            self.total += value_size
+            while self.total > self.size:
+                self.total -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        """
+        Remove all values from the cache.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.total = 0
+
+
+class NullCache():
+    """
+    A cache which never holds anything.  Useful for disabling any of
+    the caches above.
+    """
+
+    def get(self, key):
+        raise KeyError(key)
+
+    def set(self, key, value, created=None, accessed=None):
+        pass
+
+
+def main():
+    args = parse_args()
+    import mini_qa
+    cache = {"google": mini_qa.GOOGLE_CACHE,
+             "wolfram": mini_qa.WOLFRAM_CACHE}[args.cache]
+    if args.command == "expire":
+        num = cache.expire(args.ttl_days*24*60*60, args.workers)
+        print "Expired %s entries" % num
+    elif args.command == "evict":
+        num = cache.evict(args.budget_mb*2**20, args.workers)
+        print "Evicted %s entries" % num
+    elif args.command == "compact":
+        num = cache.compact(args.workers)
+        print "Rewrote %s legacy entries" % num
+    elif args.command == "sync-filter":
+        num = cache.sync_filter()
+        print "Synced filter with %s keys to %s" % (num, cache.filter_path)
+    else: # assume args.command == "stats"
+        entries = cache.entries(args.workers)
+        print "%s entries, %s bytes, %s legacy" % (
+            len(entries), sum(entry.size for entry in entries),
+            sum(1 for entry in entries if entry.version is None))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Maintain the caches.")
+    parser.add_argument("cache", choices=["google", "wolfram"])
+    parser.add_argument("command",
+                        choices=["expire", "evict", "compact", "stats",
+                                 "sync-filter"])
+    parser.add_argument("--ttl-days", type=float, default=30,
+                        help="expire entries older than this")
+    parser.add_argument("--budget-mb", type=float, default=1024,
+                        help="evict entries until the cache is this size")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="number of parallel requests to S3")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,18 @@ system.
 #### Library imports
 from __future__ import division
 import mini_qa
+from planner import QueryPlanner
 
 # Standard library
+import hashlib
 import json
+from multiprocessing.pool import ThreadPool
+import os
+
+
+#### File holding the results of previous evaluations, so questions
+#### whose inputs haven't changed aren't answered again
+RESULTS_STORE = "evaluation_results.json"
 
 
 class QAPair():
@@ -23,37 +32,176 @@ class QAPair():
         self.answers = answers
 
 
+class ResultsStore():
+    """
+    The results of evaluating each question from each source, stored
+    as JSON in `filename`.  Each result is stored with a fingerprint
+    of the inputs it was computed from, as returned by
+    `result_fingerprint`, and is only used if the fingerprint still
+    matches.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.records = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.records = json.load(f)
+
+    def get(self, question, source, fingerprint):
+        """
+        Return the stored result for `question` from `source`, or None
+        if there's none with the given `fingerprint`.
+        """
+        record = self.records.get(source+"\t"+question)
+        if record and record["fingerprint"] == fingerprint:
+            return record["result"]
+        return None
+
+    def set(self, question, source, fingerprint, result):
+        """
+        Store `result` for `question` from `source`, with `fingerprint`.
+        """
+        self.records[source+"\t"+question] = {
+            "fingerprint": fingerprint, "result": result}
+
+    def save(self):
+        """
+        Save the results.  The file is replaced atomically.
+        """
+        temp = "%s.%s.tmp" % (self.filename, os.getpid())
+        with open(temp, "w") as f:
+            json.dump(self.records, f)
+        os.rename(temp, self.filename)
+
+
 def main():
-    evaluate("google")
-    evaluate("wolfram")
-    evaluate("hybrid")
+    evaluate("google", store_file=RESULTS_STORE)
+    evaluate("wolfram", store_file=RESULTS_STORE)
+    evaluate("hybrid", store_file=RESULTS_STORE)
 
-def evaluate(source="google"):
+def evaluate(source="google", results_file=None, planner_file=None,
+             store_file=None):
     """
     Evaluate the question-answering system based on `source`.  Allowed
     values for `source` are explain in the doc string for mini_qa.qa.
+    If `results_file` is given, the answer to each question, and
+    whether it was correct, are appended to it as JSON lines, in the
+    format used by `batch.py`.  These can be used to train the router
+    in `router.py`.  If `planner_file` is given and `source` is
+    "google", the yield of each rewrite pattern is added to the
+    statistics in `planner_file`, for the query planner in
+    `planner.py`.
+
+    If `store_file` is given, the answers are kept in a ResultsStore
+    in that file, and a question is only answered again if its cached
+    inputs, or the scoring code and parameters, have changed since.
+    Answers computed while an upstream call failed aren't stored, so
+    they're computed again next time.  The metrics are always computed
+    from the answers to every question.
     """
     print "Evaluating the question-answering system based on %s" % source
     qa_pairs = load_qa_pairs()
     num_questions = len(qa_pairs)
     print "Generating candidate answers for %s questions" % num_questions
+    if store_file:
+        store = ResultsStore(store_file)
+        names = dict((qa_pair.question, input_names(qa_pair.question, source))
+                     for qa_pair in qa_pairs)
+        inputs = cached_inputs(set(
+            name for question_names in names.values()
+            for name in question_names))
+    if planner_file and source=="google":
+        if os.path.exists(planner_file):
+            planner = QueryPlanner.load(planner_file)
+        else:
+            planner = QueryPlanner()
+    results = []
+    num_reused = 0
+    num_unstored = 0
+    try:
+        for (j, qa_pair) in enumerate(qa_pairs):
+            question = qa_pair.question
+            result = None
+            if store_file:
+                fingerprint = result_fingerprint(
+                    question, source,
+                    [inputs[name] for name in names[question]])
+                result = store.get(question, source, fingerprint)
+            if result is None:
+                print "Processing question %s" % j
+                mini_qa.reset_upstream_errors()
+                result = answer_question(question, source)
+                if store_file:
+                    etags = cached_inputs(names[question])
+                    etags = [etags[name] for name in names[question]]
+                    if answered_from_cache(source, etags):
+                        store.set(question, source, result_fingerprint(
+                            question, source, etags), result)
+                    else:
+                        num_unstored += 1
+            else:
+                num_reused += 1
+            if planner_file and source=="google":
+                record_yields(planner, qa_pair)
+            results.append(result)
+    finally:
+        if store_file:
+            store.save()
+    if store_file:
+        print "Reused stored answers for %s questions" % num_reused
+        if num_unstored:
+            print ("Not storing answers for %s questions whose lookups "
+                   "failed" % num_unstored)
+    if planner_file and source=="google":
+        planner.save(planner_file)
+    for (result, qa_pair) in zip(results, qa_pairs):
+        result = dict(result)
+        if source=="google":
+            result["correct"] = 0 in correct_results(
+                result["answers"], qa_pair.answers)
+        else:
+            result["correct"] = result["answer"] in qa_pair.answers
+        if results_file:
+            with open(results_file, "a") as f:
+                f.write(json.dumps(result)+"\n")
+    report(source, results, qa_pairs)
+
+def answer_question(question, source):
+    """
+    Return a dict describing the answer to `question` from `source`,
+    in the format used by `batch.py`, but without saying whether it's
+    correct.
+    """
+    result = {"question": question, "source": source}
+    if source=="google":
+        result["answers"] = answers(question)
+    else: # assume source=="wolfram", "hybrid" or "auto"
+        result["answer"] = mini_qa.qa(question, source) or None
+    return result
+
+def report(source, results, qa_pairs):
+    """
+    Print the metrics for `results`, the answers from `source` to the
+    questions in `qa_pairs`, as returned by `answer_question`.
+    """
+    num_questions = len(qa_pairs)
     perfect_answers = 0
     if source=="google":
         okay_answers = 0
         rank_sum = 0
-    if source=="wolfram" or source=="hybrid":
+    if source!="google":
         num_answers = 0
-    for (j, qa_pair) in enumerate(qa_pairs):
-        print "Processing question %s" % j
+    for (result, qa_pair) in zip(results, qa_pairs):
         if source=="google":
-            cr = correct_results(answers(qa_pair.question), qa_pair.answers)
+            cr = correct_results(result["answers"], qa_pair.answers)
             if 0 in cr:
                 perfect_answers += 1
             if len(cr) > 0:
                 okay_answers += 1
                 rank_sum += cr[0]
-        else: # assume source=="wolfram" or source=="hybrid"
-            answer = mini_qa.qa(qa_pair.question, source)
+        else: # assume source=="wolfram", "hybrid" or "auto"
+            answer = result["answer"]
             if answer in qa_pair.answers:
                 perfect_answers += 1
             if answer: # answer is not null
@@ -65,10 +213,133 @@ def evaluate(source="google"):
             okay_answers, num_questions, okay_answers / num_questions)
         print "Average rank for answers in the top 20: {:.2f}".format(
             rank_sum / okay_answers)
-    if source=="wolfram" or source=="hybrid":
+    if source!="google":
         print "{} of {} returned a non-null answer".format(
             num_answers, num_questions)
 
+def input_names(question, source):
+    """
+    Return a list of tuples `(cache_name, name)`, naming the entries
+    in the "google" and "wolfram" caches which the answer to
+    `question` from `source` may be computed from.
+    """
+    names = []
+    if source in ("google", "hybrid", "auto"):
+        names += [("google", mini_qa.summaries_key(query.query,
+                                                   mini_qa.FETCH_DEPTH))
+                  for query in mini_qa.planned_queries(question)]
+    if source in ("wolfram", "hybrid", "auto"):
+        names.append(("wolfram", question))
+    return names
+
+def cached_inputs(names, workers=16):
+    """
+    Return a dict mapping each tuple `(cache_name, name)` in `names`
+    to the ETag of that cache entry, or None if there's no such
+    entry.  Only the given entries are looked up, by `workers` threads
+    in parallel.
+    """
+    names = list(names)
+    caches = {"google": mini_qa.GOOGLE_CACHE, "wolfram": mini_qa.WOLFRAM_CACHE}
+    def etag(name):
+        (cache_name, key) = name
+        return caches[cache_name].etag(key)
+    pool = ThreadPool(workers)
+    try:
+        return dict(zip(names, pool.map(etag, names)))
+    finally:
+        pool.close()
+
+def answered_from_cache(source, etags):
+    """
+    Return True if the answer just computed from `source` can be
+    stored, i.e., no upstream call failed while computing it, and, for
+    the "google" and "wolfram" sources, every input it was computed
+    from, with ETags `etags`, is in the cache.  Otherwise the answer
+    may reflect a transient failure, and should be computed again next
+    time.
+    """
+    if any(mini_qa.upstream_errors.counts.values()):
+        return False
+    return source not in ("google", "wolfram") or None not in etags
+
+def result_fingerprint(question, source, etags):
+    """
+    Return a fingerprint of everything the answer to `question` from
+    `source` depends on: the question, the source, the list `etags`
+    of ETags of the cache entries named by `input_names`, and
+    `mini_qa.scoring_fingerprint()`.  The "auto" source also depends
+    on the router's model.
+    """
+    parts = [question, source, etags, mini_qa.scoring_fingerprint()]
+    if source=="auto":
+        parts.append(json.dumps(mini_qa.ROUTER.model, sort_keys=True))
+    return hashlib.sha1(json.dumps(parts)).hexdigest()
+
+def compare_approximate(capacity=1000):
+    """
+    Compare the top 20 answers returned by `mini_qa.google_qa` with
+    those returned by `mini_qa.approximate_google_qa`, using
+    `capacity` counters, on the evaluation questions.
+    """
+    print "Comparing exact and approximate scoring, with capacity %s" % (
+        capacity)
+    qa_pairs = load_qa_pairs()
+    num_questions = len(qa_pairs)
+    same_top = 0
+    same_rank = 0
+    overlap_sum = 0
+    max_relative_error = 0
+    for (j, qa_pair) in enumerate(qa_pairs):
+        print "Processing question %s" % j
+        exact = answers(qa_pair.question)
+        approximate = mini_qa.approximate_google_qa(
+            qa_pair.question, capacity)[:20]
+        approximate_answers = [answer for (answer, score, error)
+                               in approximate]
+        if exact[:1] == approximate_answers[:1]:
+            same_top += 1
+        if (correct_results(exact, qa_pair.answers)[:1] ==
+            correct_results(approximate_answers, qa_pair.answers)[:1]):
+            same_rank += 1
+        overlap_sum += len(set(exact) & set(approximate_answers))
+        for (answer, score, error) in approximate:
+            max_relative_error = max(max_relative_error, error / score)
+    print "{} of {} had the same top answer ({:.2%})".format(
+        same_top, num_questions, same_top / num_questions)
+    print "{} of {} ranked the first correct answer the same ({:.2%})".format(
+        same_rank, num_questions, same_rank / num_questions)
+    print "Average overlap of the top 20 answers: {:.2f}".format(
+        overlap_sum / num_questions)
+    print "Largest error bound in the top 20: {:.2%} of the score".format(
+        max_relative_error)
+
+def record_yields(planner, qa_pair):
+    """
+    Record in `planner` the yield of each rewrite pattern for
+    `qa_pair`, i.e., the fraction of the weight of the first correct
+    answer in the top 20 which came from the query with that pattern.
+    Every rewrite is fetched, whatever the query budget.  If there's
+    no correct answer in the top 20, every pattern yields 0.
+    """
+    (summaries, complete) = mini_qa.google_summaries(qa_pair.question,
+                                                     budget=0)
+    ranked = [answer for (answer, score)
+              in mini_qa.ranked_answers(mini_qa.answer_weights(summaries))]
+    cr = correct_results(ranked[:20], qa_pair.answers)
+    total = 0
+    if cr:
+        ngram = tuple(ranked[cr[0]].split())
+        weights = dict(
+            (query.query, mini_qa.answer_weights(
+                [summary for summary in summaries
+                 if summary[1] == query.query]).get(ngram, 0))
+            for query in mini_qa.rewritten_queries(qa_pair.question))
+        total = sum(weights.values())
+    for query in mini_qa.rewritten_queries(qa_pair.question):
+        planner.record(query.pattern,
+                       weights[query.query] / total if total else 0)
+
 def load_qa_pairs():
     """
     Return a list of QAPair instances, loaded from the file
@@ -9,6 +9,10 @@ main workflow is one of:
    code to server
 
 2. `fab deploy`: run tests, and push all code to server
+
+Either way, if there's a cache snapshot (made with `fab
+export_snapshot`), it's pushed along with the code, so the server
+starts with a warm cache.
 """
 
 # Standard library
@@ -86,6 +90,7 @@ def deploy():
     """
     test()
     transfer_special_files()
+    transfer_snapshot()
     code_dir = "/home/ubuntu/"+config.GITHUB_PROJECT_NAME
     with cd(code_dir):
         run("git pull")
@@ -102,3 +107,20 @@ def transfer_special_files():
     """
     put("config.py", "/home/ubuntu/%s/config.py" % 
         config.GITHUB_PROJECT_NAME)
+
+def export_snapshot():
+    """
+    Pack the current Google and Wolfram Alpha caches into a snapshot.
+    """
+    local("python snapshot.py export cache.snapshot")
+
+def transfer_snapshot():
+    """
+    When deploying, transfer the cache snapshot, if there is one.  The
+    snapshot is uploaded alongside the old one, then moved into place,
+    so a running server never reads a partly uploaded snapshot.
+    """
+    if os.path.exists("cache.snapshot"):
+        path = "/home/ubuntu/%s/cache.snapshot" % config.GITHUB_PROJECT_NAME
+        put("cache.snapshot", path+".tmp")
+        run("mv %s.tmp %s" % (path, path))
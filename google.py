@@ -41,17 +41,21 @@
 #
 # This is a modification, by Michael Nielsen (2012).
 
-__all__ = ['search']
+__all__ = ['search', 'search_pages']
 
 import BeautifulSoup
 import cookielib
 import os
 import random
+import socket
+import threading
 import time
 import urllib
 import urllib2
 import urlparse
 
+import transport
+
 # URL templates to make Google searches.
 url_home          = "http://www.google.%(tld)s/"
 url_search        = "http://www.google.%(tld)s/search?hl=%(lang)s&q=%(query)s&btnG=Google+Search"
@@ -59,6 +63,9 @@ url_next_page     = "http://www.google.%(tld)s/search?hl=%(lang)s&q=%(query)s&st
 url_search_num    = "http://www.google.%(tld)s/search?hl=%(lang)s&q=%(query)s&num=%(num)d&btnG=Google+Search"
 url_next_page_num = "http://www.google.%(tld)s/search?hl=%(lang)s&q=%(query)s&num=%(num)d&start=%(start)d"
 
+# Largest number of results Google returns on one page.
+max_num = 100
+
 # Cookie jar. Stored at the user's home folder.
 home_folder = os.getenv('HOME')
 if not home_folder:
@@ -72,15 +79,58 @@ try:
 except Exception:
     pass
 
+# Limits the rate of requests for further result pages.
+class RateLimiter(object):
+    """
+    A token bucket, shared by all threads, which allows bursts of up to
+    C{burst} requests, and C{rate} requests per second on average.
+    """
+
+    def __init__(self, rate=1.0, burst=4):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """
+        Wait until a request may be made.
+
+        @type  timeout: float
+        @param timeout: Longest time to wait, in seconds.
+            Use C{None} to wait as long as needed.
+
+        @raise socket.timeout: Raised if the wait would exceed C{timeout}.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now-self.updated)*self.rate)
+            self.updated = now
+            self.tokens -= 1
+            delay = -self.tokens/self.rate if self.tokens < 0 else 0
+            if timeout is not None and delay > timeout:
+                self.tokens += 1
+                raise socket.timeout("rate limit wait exceeds time budget")
+        time.sleep(delay)
+
+# The rate limiter used by search_pages. Set to None to disable it.
+rate_limiter = RateLimiter()
+
 # Request the given URL and return the response page, using the cookie
 # jar.
-def get_page(url):
+def get_page(url, timeout=None):
     """
     Request the given URL and return the response page, using the cookie jar.
 
     @type  url: str
     @param url: URL to retrieve.
 
+    @type  timeout: float
+    @param timeout: Seconds to wait for the server before giving up.
+        Use C{None} to use the default socket timeout.
+
     @rtype:  str
     @return: Web page retrieved for the given URL.
 
@@ -92,7 +142,7 @@ def get_page(url):
     request.add_header('User-Agent',
                        'Mozilla/4.0 (compatible; MSIE 8.0; Windows NT 6.0)')
     cookie_jar.add_cookie_header(request)
-    response = urllib2.urlopen(request)
+    response = transport.urlopen(request, timeout=timeout)
     cookie_jar.extract_cookies(response, request)
     html = response.read()
     response.close()
@@ -126,7 +176,8 @@ def filter_result(link):
     return None
 
 # Returns a generator that yields URLs.
-def search(query, tld='com', lang='en', num=10, start=0, stop=None, pause=10.0):
+def search(query, tld='com', lang='en', num=10, start=0, stop=None, pause=10.0,
+           timeout=None):
     """
     Search the given query string using Google.
 
@@ -154,12 +205,21 @@ def search(query, tld='com', lang='en', num=10, start=0, stop=None, pause=10.0):
         A lapse too long will make the search slow, but a lapse too short may
         cause Google to block your IP. Your mileage may vary!
 
+    @type  timeout: float
+    @param timeout: Total time budget in seconds for the search, including
+        the pause.  Use C{None} for no limit.
+
     @rtype:  generator
     @return: Generator (iterator) that yields found URLs. If the C{stop}
         parameter is C{None} the iterator will loop forever.
+
+    @raise socket.timeout: Raised if the time budget runs out, or is
+        too short for the pause.
     """
+    time_left = budget(timeout)
+
     # pause, so as to not overburden google
-    time.sleep(pause+(random.random()-0.5)*5)
+    wait(pause, time_left)
 
     # Set of hashes for the results found.
     # This is used to avoid repeated results.
@@ -169,7 +229,7 @@ def search(query, tld='com', lang='en', num=10, start=0, stop=None, pause=10.0):
     query = urllib.quote_plus(query)
 
     # Grab the cookie from the home page.
-    get_page(url_home % vars())
+    get_page(url_home % vars(), time_left())
 
     # Prepare the URL of the first request.
     if num == 10:
@@ -178,12 +238,118 @@ def search(query, tld='com', lang='en', num=10, start=0, stop=None, pause=10.0):
         url = url_search_num % vars()
 
     # Request the Google Search results page.
-    html = get_page(url)
+    html = get_page(url, time_left())
 
     # Parse the response and extract the summaries
+    return parse_summaries(html)
+
+# Returns a list of summaries, fetching as many pages as needed.
+def search_pages(query, tld='com', lang='en', depth=10, start=0, pause=10.0,
+                 timeout=None):
+    """
+    Search the given query string using Google, and return the
+    summaries of results C{start} up to C{depth}.
+
+    The first page holds up to C{max_num} results.  If it's full and
+    more results are wanted, the remaining pages are fetched
+    concurrently, each waiting on C{rate_limiter} instead of pausing.
+
+    @type  query: str
+    @param query: Query string. Must NOT be url-encoded.
+
+    @type  depth: int
+    @param depth: Number of results wanted, counting from the first.
+
+    @type  start: int
+    @param start: First result to retrieve.
+
+    @type  pause: float
+    @param pause: Lapse to wait before the first HTTP request.
+
+    @type  timeout: float
+    @param timeout: Total time budget in seconds for the search, including
+        the pause.  Use C{None} for no limit.
+
+    @rtype:  list
+    @return: List of the C{div.s} summaries found, in order.  Fewer than
+        C{depth-start} are returned if Google runs out of results.
+
+    @raise socket.timeout: Raised if the time budget runs out, or is
+        too short for the pause.
+    """
+    time_left = budget(timeout)
+    wait(pause, time_left)
+    query = urllib.quote_plus(query)
+    get_page(url_home % vars(), time_left())
+
+    def fetch(start, num, limit=True):
+        if limit and rate_limiter is not None:
+            rate_limiter.acquire(time_left())
+        return parse_summaries(get_page(url_next_page_num % {
+            'tld': tld, 'lang': lang, 'query': query, 'num': num,
+            'start': start}, time_left()))
+
+    num = min(max_num, depth-start)
+    summaries = fetch(start, num, limit=False)
+    if len(summaries) < num:
+        return summaries
+
+    # Fetch the remaining pages concurrently.
+    starts = range(start+num, depth, max_num)
+    pages = [None]*len(starts)
+    errors = []
+    def fetch_page(j):
+        try:
+            pages[j] = fetch(starts[j], min(max_num, depth-starts[j]))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=fetch_page, args=(j,))
+               for j in range(len(starts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    for page in pages:
+        summaries.extend(page)
+        if len(page) < max_num:
+            break
+    return summaries
+
+# Returns a function giving the time left in the budget.
+def budget(timeout):
+    """
+    Return a function which returns the seconds left of a budget of
+    C{timeout} seconds, starting now, or C{None} if C{timeout} is
+    C{None}.  The function raises C{socket.timeout} once the budget
+    runs out.
+    """
+    if timeout is None:
+        return lambda: None
+    deadline = time.time() + timeout
+    def time_left():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout("search time budget exhausted")
+        return remaining
+    return time_left
+
+# Pause for about the given lapse, unless it won't fit in the time budget.
+def wait(pause, time_left):
+    delay = pause+(random.random()-0.5)*min(5, pause)
+    remaining = time_left()
+    if remaining is not None and delay >= remaining:
+        # There'd be no time left to search, so give up now
+        raise socket.timeout("search pause exceeds time budget")
+    time.sleep(max(delay, 0))
+
+# Parse a Google results page and return its summaries.
+def parse_summaries(html):
     soup = BeautifulSoup.BeautifulSoup(html)
     return soup.findAll("div", {"class": "s"})
-    
+
+
 # When run as a script, take all arguments as a search query and run it.
 if __name__ == "__main__":
     import sys
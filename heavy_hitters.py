@@ -0,0 +1,80 @@
+"""
+heavy_hitters.py
+~~~~~~~~~~~~~~~~
+
+The Space-Saving algorithm (Metwally, Agrawal and El Abbadi, 2005),
+for finding the items with the largest total weight in a stream,
+using a fixed amount of memory.
+
+At most `capacity` items are tracked.  When a new item arrives and the
+table is full, the item with the smallest count is evicted, and the
+new item inherits its count, which is recorded as the new item's
+error.  Every estimated count is then an overestimate by at most its
+error, and every error is at most `total/capacity`, where `total` is
+the total weight of the stream.  Any item whose true count exceeds
+`total/capacity` is guaranteed to be in the table.
+"""
+
+#### Library imports
+
+# Standard library
+import heapq
+
+
+class SpaceSaving():
+    """
+    Tracks the (approximately) heaviest items among those added, using
+    at most `capacity` counters.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # One (count, item) entry per tracked item.  Counts only grow,
+        # so an entry may be out of date, in which case it's refreshed
+        # when it reaches the top of the heap.
+        self.heap = []
+        self.total = 0
+
+    def add(self, item, weight=1):
+        """
+        Add `weight` to the count for `item`.
+        """
+        self.total += weight
+        if item in self.counts:
+            self.counts[item] += weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = weight
+            self.errors[item] = 0
+            heapq.heappush(self.heap, (weight, item))
+            return
+        while True:
+            (count, smallest) = self.heap[0]
+            if self.counts[smallest] == count:
+                break
+            heapq.heapreplace(self.heap, (self.counts[smallest], smallest))
+        del self.counts[smallest]
+        del self.errors[smallest]
+        self.counts[item] = count + weight
+        self.errors[item] = count
+        heapq.heapreplace(self.heap, (count + weight, item))
+
+    def error_bound(self):
+        """
+        Return the largest possible error of any estimated count.
+        """
+        return self.total / float(self.capacity)
+
+    def top(self, num=None):
+        """
+        Return a list of tuples `(item, count, error)` for the `num`
+        items with the largest estimated counts (or all tracked
+        items), in decreasing order of count, with ties broken by the
+        item.  The true count of each item is between `count-error`
+        and `count`.
+        """
+        items = sorted(self.counts.iteritems(),
+                       key=lambda x: (-x[1], x[0]))[:num]
+        return [(item, count, self.errors[item]) for (item, count) in items]
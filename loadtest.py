@@ -0,0 +1,258 @@
+"""
+loadtest.py
+~~~~~~~~~~~
+
+Load-tests the `mini_qa.py` question-answering system, without
+touching Google or Wolfram Alpha.  We start local HTTP servers which
+stand in for them: one serves Google-style result pages containing
+`div.s` summaries, and the other serves Wolfram Alpha-style XML with
+a primary pod.  Both add a configurable latency, and fail a
+configurable fraction of requests.  We then point `google.py` and the
+Wolfram Alpha client at those servers, disable the caches, and answer
+questions at each of the given levels of concurrency, reporting
+throughput, latency percentiles and errors for each source.  A
+question counts as an error if answering it raised an exception, or
+if any call to an upstream server failed, and the failed calls are
+also counted for each upstream server.
+
+Example:
+
+    python loadtest.py -c 10 100 1000 -n 2000 --latency 0.05 --error-rate 0.01
+"""
+
+#### Library imports
+from __future__ import division
+import cache
+import evaluation
+import google
+import mini_qa
+
+# Standard library
+import argparse
+import BaseHTTPServer
+import random
+import SocketServer
+import threading
+import time
+import urlparse
+from xml.sax.saxutils import escape
+
+
+#### Words used to make up the text of fake summaries
+FAKE_WORDS = ("Ada Lovelace Charles Babbage wrote the first program for the "
+              "Analytical Engine in London and it was published").split()
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A threaded HTTP server on localhost which delays each response by
+    about `latency` seconds, and fails a fraction `error_rate` of
+    requests with a 503 error.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, handler, latency=0.0, error_rate=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def url(self, path=""):
+        return "http://127.0.0.1:%s/%s" % (self.server_address[1], path)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Base class for the fake servers' request handlers.  Subclasses
+    define `content_type` and `body(query)`, where `query` is the
+    query string (for GET) or request body (for POST).
+    """
+
+    def do_GET(self):
+        self.respond(urlparse.urlparse(self.path).query)
+
+    def do_POST(self):
+        length = int(self.headers.getheader("content-length") or 0)
+        self.respond(self.rfile.read(length))
+
+    def respond(self, query):
+        server = self.server
+        if server.latency:
+            time.sleep(random.expovariate(1/server.latency))
+        if random.random() < server.error_rate:
+            self.send_error(503)
+            return
+        body = self.body(urlparse.parse_qs(query))
+        self.send_response(200)
+        self.send_header("Content-Type", self.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeGoogleHandler(FakeHandler):
+    content_type = "text/html"
+
+    def body(self, params):
+        num = int(params.get("num", ["10"])[0])
+        summaries = "".join(
+            "<li><div class=\"s\">%s.</div></li>" % fake_text()
+            for j in range(num))
+        return "<html><body><ol>%s</ol></body></html>" % summaries
+
+
+class FakeWolframHandler(FakeHandler):
+    content_type = "text/xml"
+
+    def body(self, params):
+        question = params.get("input", [""])[0]
+        return (
+            "<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+            "<queryresult success=\"true\" error=\"false\" numpods=\"2\">"
+            "<pod title=\"Input interpretation\" position=\"100\">"
+            "<subpod title=\"\"><plaintext>%s</plaintext></subpod></pod>"
+            "<pod title=\"Result\" position=\"200\" primary=\"true\">"
+            "<subpod title=\"\"><plaintext>%s</plaintext></subpod></pod>"
+            "</queryresult>") % (escape(question), fake_text(2))
+
+
+def fake_text(num_words=20):
+    """
+    Return `num_words` random words from FAKE_WORDS.
+    """
+    return " ".join(random.choice(FAKE_WORDS) for j in range(num_words))
+
+def main():
+    args = parse_args()
+    google_server = FakeServer(FakeGoogleHandler, args.latency,
+                               args.error_rate)
+    wolfram_server = FakeServer(FakeWolframHandler, args.latency,
+                                args.error_rate)
+    google_server.start()
+    wolfram_server.start()
+    use_fake_servers(google_server.url(), wolfram_server.url("query.jsp"))
+    questions = [qa_pair.question for qa_pair in evaluation.load_qa_pairs()]
+    print "source   concurrency  questions  q/sec    p50     p95     p99" \
+        "    errors  timeouts  google-fail  wolfram-fail"
+    for source in args.sources:
+        for concurrency in args.concurrency:
+            stats = run(questions, source, concurrency, args.num,
+                        args.timeout)
+            report(source, concurrency, stats)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Load-test mini_qa against fake Google and Wolfram "
+        "Alpha servers.")
+    parser.add_argument("-c", "--concurrency", type=int, nargs="+",
+                        default=[10, 100, 1000],
+                        help="numbers of questions to answer at once")
+    parser.add_argument("-n", "--num", type=int, default=1000,
+                        help="number of questions per run")
+    parser.add_argument("-s", "--sources", nargs="+",
+                        default=["google", "wolfram", "hybrid"],
+                        choices=["google", "wolfram", "hybrid", "auto"])
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="mean latency of the fake servers, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests the fake servers fail")
+    parser.add_argument("-t", "--timeout", type=float, default=None,
+                        help="time budget in seconds for each question")
+    return parser.parse_args()
+
+def use_fake_servers(google_url, wolfram_url):
+    """
+    Point `google.py` at the server at `google_url`, and the Wolfram
+    Alpha client at `wolfram_url`.  Also disable the caches, the
+    pause between searches and the rate limit on further result
+    pages, so every question reaches the servers.
+    """
+    for name in ["url_home", "url_search", "url_next_page",
+                 "url_search_num", "url_next_page_num"]:
+        template = getattr(google, name)
+        setattr(google, name,
+                template.replace("http://www.google.%(tld)s/", google_url))
+    mini_qa.WOLFRAM_CLIENT.engine.server = wolfram_url
+    mini_qa.GOOGLE_CACHE = cache.NullCache()
+    mini_qa.WOLFRAM_CACHE = cache.NullCache()
+    mini_qa.ANSWER_CACHE = cache.NullCache()
+    mini_qa.SEARCH_PAUSE = 0
+    google.rate_limiter = None
+
+def run(questions, source, concurrency, num, timeout=None):
+    """
+    Answer `num` questions, cycling through `questions`, from `source`
+    using `concurrency` threads.  Return a dict with the total time
+    taken, a list of latencies of successful answers, the number of
+    errors and timeouts, and the number of failed calls to each
+    upstream source.  A question is only a success if no upstream call
+    failed while answering it, even if `mini_qa.qa` returned normally.
+    """
+    stats = {"latencies": [], "errors": 0, "timeouts": 0,
+             "upstream_errors": {"google": 0, "wolfram": 0}}
+    lock = threading.Lock()
+    remaining = iter(xrange(num))
+    def work():
+        while True:
+            with lock:
+                j = next(remaining, None)
+            if j is None:
+                return
+            mini_qa.reset_upstream_errors()
+            start = time.time()
+            deadline = None if timeout is None else start + timeout
+            try:
+                result = mini_qa.qa(questions[j % len(questions)], source,
+                                    deadline)
+            except Exception:
+                result = None
+                failed = True
+            else:
+                failed = any(mini_qa.upstream_errors.counts.values())
+            latency = time.time()-start
+            with lock:
+                for (name, count) in mini_qa.upstream_errors.counts.items():
+                    stats["upstream_errors"][name] += count
+                if failed:
+                    stats["errors"] += 1
+                elif mini_qa.timed_out(result):
+                    stats["timeouts"] += 1
+                else:
+                    stats["latencies"].append(latency)
+    threads = [threading.Thread(target=work) for j in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats["seconds"] = time.time()-start
+    stats["num"] = num
+    return stats
+
+def percentile(values, p):
+    """
+    Return the `p`th percentile of the sorted list `values`.
+    """
+    if not values:
+        return float("nan")
+    return values[int(round(p/100*(len(values)-1)))]
+
+def report(source, concurrency, stats):
+    latencies = sorted(stats["latencies"])
+    print "%-8s %11d %10d %6.1f %7.3f %7.3f %7.3f %9d %9d %12d %13d" % (
+        source, concurrency, stats["num"], stats["num"]/stats["seconds"],
+        percentile(latencies, 50), percentile(latencies, 95),
+        percentile(latencies, 99), stats["errors"], stats["timeouts"],
+        stats["upstream_errors"]["google"],
+        stats["upstream_errors"]["wolfram"])
+
+if __name__ == "__main__":
+    main()
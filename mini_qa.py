@@ -10,18 +10,35 @@ Toy question-answering program.
 # standard library
 from collections import defaultdict
 import cPickle as pickle
+import hashlib
+import heapq
+import inspect
 import json
+import multiprocessing
+import os
 import re
+import socket
 import sys
+import threading
+import time
+import urllib2
 from xml.etree import ElementTree
 
 # third-party libraries
 import boto
 from boto.s3.connection import S3Connection
-from boto.s3.key import Key
-from google import search
+import BeautifulSoup
+from google import search_pages
 import wolfram
 
+# My libraries
+import cache
+import snapshot
+from heavy_hitters import SpaceSaving
+from planner import QueryPlanner
+import router
+import wolfram_client
+
 
 #### Config
 
@@ -34,18 +51,96 @@ except ImportError:
 
 wolfram_server = 'http://api.wolframalpha.com/v1/query.jsp'
 
+#### Timeouts (in seconds) for Wolfram Alpha queries.  The scan, pod
+#### and format timeouts are enforced by the Wolfram Alpha server, and
+#### the request timeout by us.
+WOLFRAM_SCAN_TIMEOUT = 3.0
+WOLFRAM_POD_TIMEOUT = 4.0
+WOLFRAM_FORMAT_TIMEOUT = 2.0
+WOLFRAM_REQUEST_TIMEOUT = 10.0
+
 #### Parameters used to score results returned from the Google-based
 #### system
 CAPITALIZATION_FACTOR = 2.2
 QUOTED_QUERY_SCORE = 5
 UNQUOTED_QUERY_SCORE = 2
 
+#### Local files holding Bloom filters of the keys in the Google and
+#### Wolfram Alpha caches.  Create or refresh them with `python cache.py
+#### google sync-filter` (and similarly for wolfram).
+GOOGLE_CACHE_FILTER = "google-cache.bloom"
+WOLFRAM_CACHE_FILTER = "wolfram-cache.bloom"
+
+#### File holding the model used to route questions when the source is
+#### "auto".  Train it with `router.py`.
+ROUTER_MODEL = "router.json"
+
+#### With the "auto" source, Wolfram Alpha is only asked if the router
+#### thinks the probability it answers is at least
+#### WOLFRAM_ROUTE_THRESHOLD, and Google is only asked if the
+#### probability its top answer is correct is at least
+#### GOOGLE_ROUTE_THRESHOLD
+WOLFRAM_ROUTE_THRESHOLD = 0.2
+GOOGLE_ROUTE_THRESHOLD = 0.02
+
+#### File holding the rewrite pattern statistics used by the query
+#### planner.  Record them with `evaluation.evaluate`.
+PLANNER_STATS = "planner.json"
+
+#### If positive, at most this many rewritten queries are sent to
+#### Google for each question, chosen by the query planner.  See
+#### `planned_queries`.
+QUERY_BUDGET = 0
+
+#### File holding a snapshot of the caches, made with `snapshot.py`.
+#### If it exists, it's used in preference to S3.
+SNAPSHOT_PATH = "cache.snapshot"
+
+#### Seconds to pause before each Google search, so as not to
+#### overburden Google.  See `google.search`.
+SEARCH_PAUSE = 10.0
+
+#### Number of summaries fetched from Google for each rewritten query.
+#### Google's own default is 10; deeper fetches use pages of up to 100
+#### results, fetched concurrently.  See `google.search_pages`.
+FETCH_DEPTH = 10
+
+#### Depths at which Google results are looked for in the cache when
+#### the results at FETCH_DEPTH aren't there, so they can be extended
+#### instead of refetched
+CACHED_DEPTHS = [10, 20, 50, 100, 200, 300, 500, 1000]
+
+#### Number of processes used to score the summaries returned by
+#### Google.  If 0, scoring is done in this process.
+SCORING_PROCESSES = 0
+
+#### If positive, Google answers are scored approximately, keeping at
+#### most this many candidate answers in memory.  See
+#### `approximate_google_qa`.
+APPROXIMATE_CAPACITY = 0
+
+#### Maximum total number of answers to keep in the in-memory answer
+#### cache.  Each entry from Google holds its whole ranked list of
+#### candidate answers, which counts as that many answers (roughly
+#### 160 bytes each).  Other entries count as one.
+ANSWER_CACHE_SIZE = 500000
+
+#### Load the cache snapshot, if there is one
+if os.path.exists(SNAPSHOT_PATH):
+    SNAPSHOT = snapshot.Snapshot(SNAPSHOT_PATH)
+else:
+    SNAPSHOT = None
+
 #### Create or retrieve an S3 bucket for the cache of Google search
 #### results
 s3conn = S3Connection(config.AWS_ACCESS_KEY_ID, config.AWS_SECRET_ACCESS_KEY)
 google_cache_bucket_name = (config.AWS_ACCESS_KEY_ID).lower()+"-google-cache"
 try:
-    GOOGLE_CACHE = Key(s3conn.create_bucket(google_cache_bucket_name))
+    GOOGLE_CACHE = cache.Cache(
+        s3conn.create_bucket(google_cache_bucket_name),
+        legacy_decoder=lambda summaries: [unicode(s) for s in summaries],
+        filter_path=GOOGLE_CACHE_FILTER, name="google",
+        snapshot=SNAPSHOT)
 except boto.exception.S3CreateError:
     print ("When creating an S3 bucket for Google cache results, a conflict\n"
            "occurred, and a bucket with the desired name already exists.")
@@ -55,13 +150,41 @@ except boto.exception.S3CreateError:
 #### results
 wolfram_cache_bucket_name = (config.AWS_ACCESS_KEY_ID).lower()+"-wolfram-cache"
 try:
-    WOLFRAM_CACHE = Key(s3conn.create_bucket(wolfram_cache_bucket_name))
+    WOLFRAM_CACHE = cache.Cache(
+        s3conn.create_bucket(wolfram_cache_bucket_name),
+        filter_path=WOLFRAM_CACHE_FILTER, name="wolfram",
+        snapshot=SNAPSHOT)
 except boto.exception.S3CreateError:
     print ("When creating an S3 bucket for Wolfram Alpha cache results, a\n"
            "conflict occurred, and a bucket with the desired name already\n"
            "exists.")
     sys.exit()
 
+#### Router for the "auto" source.  Until a model is trained, it
+#### routes every question to both sources, like "hybrid".
+if os.path.exists(ROUTER_MODEL):
+    ROUTER = router.Router.load(ROUTER_MODEL)
+else:
+    ROUTER = router.Router()
+
+#### Query planner.  Until statistics are recorded, it keeps the
+#### first rewrites.
+if os.path.exists(PLANNER_STATS):
+    PLANNER = QueryPlanner.load(PLANNER_STATS)
+else:
+    PLANNER = QueryPlanner()
+
+#### Cache of final answers returned by `qa`
+ANSWER_CACHE = cache.LRUCache(
+    ANSWER_CACHE_SIZE,
+    lambda answers: len(answers) if isinstance(answers, list) else 1)
+
+#### A single Wolfram Alpha client, reused for all queries
+WOLFRAM_CLIENT = wolfram_client.WolframClient(
+    config.WOLFRAM_APPID, wolfram_server,
+    scan_timeout=WOLFRAM_SCAN_TIMEOUT, pod_timeout=WOLFRAM_POD_TIMEOUT,
+    format_timeout=WOLFRAM_FORMAT_TIMEOUT, timeout=WOLFRAM_REQUEST_TIMEOUT)
+
 
 def pretty_qa(question, source="google", num=10):
     """
@@ -74,44 +197,394 @@ def pretty_qa(question, source="google", num=10):
     if source=="google":
         for (j, (answer, score)) in enumerate(qa(question, source)[:num]):
             print "%s. %s (%s)" % (j+1, answer, score)
-    else: # assume source=="wolfram" or source=="hybrid"
+    else: # assume source=="wolfram", "hybrid" or "auto"
         answer = qa(question, source)
         if answer:
             print answer
         else:
             print "No answer returned"
 
-def qa(question, source="google"):
+def qa(question, source="google", deadline=None):
     """
     Return answers to `question` from `source`.  Allowed values for
-    `source` are "google", "wolfram" and "hybrid".  Note that the
-    format of the answers returned will depend on the value of
-    `source`.  See `google_qa`, `wolfram_qa` and `hybrid_qa` for
-    details.
-    """
+    `source` are "google", "wolfram", "hybrid" and "auto".  Note that
+    the format of the answers returned will depend on the value of
+    `source`.  See `google_qa`, `wolfram_qa`, `hybrid_qa` and
+    `auto_qa` for details.
+
+    `deadline` is an optional time, as returned by `time.time()`, by
+    which we should have answered.  The remaining time is passed on to
+    every network call.  If the deadline passes we return the best
+    answer we have so far, as a PartialAnswers or PartialAnswer
+    instance.  Use `timed_out` to check for this.
+
+    Answers are kept in ANSWER_CACHE, so a question which tokenizes
+    the same way as one already answered (see `answer_cache_key`) is
+    answered immediately.  The cached answers are shared, and should
+    not be modified.  Answers found while an upstream call failed (see
+    `upstream_errors`, whose counts are reset here) aren't cached.
+    """
+    reset_upstream_errors()
+    key = answer_cache_key(question, source)
+    try:
+        result = ANSWER_CACHE.get(key)
+    except KeyError:
+        pass
+    else:
+        record_cache_lookup(True)
+        return result
     if source=="google":
-        return google_qa(question)
+        result = google_qa(question, deadline)
     elif source=="wolfram": 
-        return wolfram_qa(question)
+        try:
+            result = wolfram_qa(question, deadline)
+        except DeadlineExceeded:
+            result = PartialAnswer()
+    elif source=="auto":
+        result = auto_qa(question, deadline)
     else: # assume source=="hybrid"
-        return hybrid_qa(question)
+        result = hybrid_qa(question, deadline)
+    # Empty answers are cheap to recompute, and may be due to errors.
+    # So may answers found after an upstream call failed, e.g., a
+    # hybrid answer from Google when Wolfram Alpha was down.
+    if (result and not timed_out(result) and
+        not any(upstream_errors.counts.values())):
+        ANSWER_CACHE.set(key, result)
+    return result
+
+def answer_cache_key(question, source):
+    """
+    Return the key under which the answer to `question` from `source`
+    is stored in ANSWER_CACHE.  The key includes the tokenized
+    question, so differences in case, punctuation and whitespace
+    are ignored, and `scoring_fingerprint()`, so changes to the
+    scoring code or parameters invalidate old answers.
+    """
+    return (" ".join(tokenize(question)), source, scoring_fingerprint())
+
+#### Names of the functions (and classes) which determine the answers
+#### returned by `qa`, from fetching the results to scoring them, used
+#### to fingerprint the scoring code.  Anything new on that path needs
+#### adding here, or stale answers will be served from the cache.
+SCORING_FUNCTIONS = [
+    "qa", "google_qa", "approximate_google_qa", "google_summaries",
+    "summaries_by_query", "get_summaries", "summaries_key", "sentences",
+    "text_of", "answer_weights", "ranked_answers", "rewritten_queries",
+    "RewrittenQuery", "tokenize", "text_sentences", "remove_spurious_words",
+    "candidate_answers", "ngrams", "ngram_score", "is_capitalized",
+    "wolfram_qa", "wolfram_qa_uncached", "primary_answer", "hybrid_qa",
+    "auto_qa", "top_google_answer", "approximate_ranked_answers",
+    "weighted_candidates", "planned_queries", "parallel_ranked_answers",
+    "partition_weights", "rank_partition"]
+
+_scoring_code_hash = None
+
+def scoring_fingerprint():
+    """
+    Return a string which changes whenever the scoring parameters, the
+    source code of SCORING_FUNCTIONS, or (with a query budget) the
+    planner's statistics, change.
+    """
+    global _scoring_code_hash
+    if _scoring_code_hash is None:
+        _scoring_code_hash = hashlib.sha1("".join(
+            inspect.getsource(globals()[name])
+            for name in SCORING_FUNCTIONS)).hexdigest()[:12]
+    return "%s-%r-%r-%r-%r-%r-%r%s" % (
+        _scoring_code_hash, CAPITALIZATION_FACTOR, QUOTED_QUERY_SCORE,
+        UNQUOTED_QUERY_SCORE, APPROXIMATE_CAPACITY, FETCH_DEPTH,
+        QUERY_BUDGET, "-"+PLANNER.fingerprint() if QUERY_BUDGET else "")
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the deadline for answering a question passes.
+    """
+    pass
+
+
+class PartialAnswers(list):
+    """
+    A list of answers returned by `google_qa` when the deadline passed
+    before all the search results were processed.
+    """
+    timed_out = True
+
+
+class PartialAnswer(unicode):
+    """
+    A (possibly empty) answer returned by `wolfram_qa`, `hybrid_qa` or
+    `auto_qa` when the deadline passed before an answer was found.
+    """
+    timed_out = True
+
+
+def timed_out(result):
+    """
+    Return True if `result`, as returned by `qa`, was cut short by the
+    deadline.
+    """
+    return getattr(result, "timed_out", False)
+
+def time_left(deadline):
+    """
+    Return the number of seconds left before `deadline`, or None if
+    there is no deadline.  Raises DeadlineExceeded if the deadline has
+    passed.
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining
+
+def is_timeout(error):
+    """
+    Return True if the exception `error` was caused by a socket
+    timeout.
+    """
+    if isinstance(error, urllib2.URLError):
+        error = error.reason
+    return isinstance(error, socket.timeout)
 
-def google_qa(question):
+def google_qa(question, deadline=None, processes=None, capacity=None):
     """
     Return a list of tuples whose first entry is a candidate answer to
     `question`, and whose second entry is the score for that answer.
-    The tuples are ordered in decreasing order of score.  
-    """
-    answer_scores = defaultdict(int)
-    for query in rewritten_queries(question):
-        for summary in get_summaries(query.query):
-            for sentence in sentences(summary):
-                for ngram in candidate_answers(sentence, query.query):
-                    answer_scores[ngram] += ngram_score(
-                        ngram, query.score)
-    ngrams_with_scores = sorted(answer_scores.iteritems(), 
-                                key=lambda x: x[1], 
-                                reverse=True)
+    The tuples are ordered in decreasing order of score, with ties
+    broken by the answer.  If `deadline` passes, the answers found so
+    far are returned as a PartialAnswers instance.
+
+    If `processes` (default `SCORING_PROCESSES`) is positive, the
+    summaries are scored by a pool of that many processes.  The
+    answers and scores are exactly the same either way.
+
+    If `capacity` (default `APPROXIMATE_CAPACITY`) is positive, the
+    scores are estimated in bounded memory, as described in
+    `approximate_google_qa`.
+    """
+    if processes is None:
+        processes = SCORING_PROCESSES
+    if capacity is None:
+        capacity = APPROXIMATE_CAPACITY
+    if capacity > 0:
+        (answers, complete) = approximate_ranked_answers(
+            question, capacity, deadline)
+        answers = [(answer, score) for (answer, score, error) in answers]
+        return answers if complete else PartialAnswers(answers)
+    (summaries, complete) = google_summaries(question, deadline)
+    if processes > 0:
+        answers = parallel_ranked_answers(summaries, processes)
+    else:
+        answers = ranked_answers(answer_weights(summaries))
+    return answers if complete else PartialAnswers(answers)
+
+def approximate_google_qa(question, capacity=1000, deadline=None):
+    """
+    Return a list of tuples `(answer, score, error)` of candidate
+    answers to `question`, like `google_qa`, but keeping at most
+    `capacity` candidate answers in memory, however many there are.
+    Each score is an overestimate, by at most `error`, and no error
+    exceeds the total score of all candidates divided by `capacity`.
+    `evaluation.compare_approximate` checks how closely the ranking
+    matches `google_qa`'s.
+    """
+    (answers, complete) = approximate_ranked_answers(
+        question, capacity, deadline)
+    return answers if complete else PartialAnswers(answers)
+
+def google_summaries(question, deadline=None, budget=None):
+    """
+    Return a tuple `(summaries, complete)`.  `summaries` is a list of
+    tuples `(text, query, score)`, giving the text of each summary
+    Google returns for the rewritten queries for `question` chosen by
+    `planned_queries(question, budget)`, and the query and score of
+    the RewrittenQuery which returned it.  `complete` is False if
+    `deadline` passed before all the summaries were retrieved.
+    """
+    summaries = []
+    try:
+        for query_summaries in summaries_by_query(question, deadline, budget):
+            summaries.extend(query_summaries)
+    except DeadlineExceeded:
+        return (summaries, False)
+    return (summaries, True)
+
+def summaries_by_query(question, deadline=None, budget=None):
+    """
+    Generate a list of summaries for each of the rewritten queries
+    for `question` chosen by `planned_queries(question, budget)`, in
+    the format described in `google_summaries`.  Each query's
+    summaries are only retrieved when they're needed.  Raises
+    DeadlineExceeded if `deadline` passes.
+    """
+    for query in planned_queries(question, budget):
+        yield [(text_of(summary), query.query, query.score)
+               for summary in get_summaries(query.query, deadline=deadline)]
+
+def approximate_ranked_answers(question, capacity, deadline=None):
+    """
+    Return a tuple `(answers, complete)`, where `answers` is a list of
+    `(answer, score, error)` tuples for the candidate answers to
+    `question`, as described in `approximate_google_qa`, and
+    `complete` is False if `deadline` passed.  Each query's summaries
+    are added to the sketch as they arrive, so memory is bounded by
+    `capacity` and the number of summaries for a single query, not
+    the total number of summaries.
+    """
+    sketch = SpaceSaving(capacity)
+    complete = True
+    try:
+        for summaries in summaries_by_query(question, deadline):
+            for (ngram, weight) in weighted_candidates(summaries):
+                sketch.add(ngram, ngram_score(ngram, weight))
+    except DeadlineExceeded:
+        complete = False
+    answers = [(" ".join(ngram), score, error)
+               for (ngram, score, error) in sketch.top()]
+    return (answers, complete)
+
+def answer_weights(summaries):
+    """
+    Return a dict mapping each candidate answer (as an n-gram) to its
+    total weight, i.e., the sum of the scores of the queries which
+    returned it, once per occurrence.  `summaries` is a list of tuples
+    `(text, query, score)`, giving the text of a summary, and the
+    query and score of the RewrittenQuery which returned it.
+    """
+    weights = defaultdict(int)
+    for (ngram, weight) in weighted_candidates(summaries):
+        weights[ngram] += weight
+    return weights
+
+def weighted_candidates(summaries):
+    """
+    Generate tuples `(ngram, weight)` for the candidate answers in
+    `summaries`, as described in `answer_weights`, summing to the same
+    total weight for each n-gram.  Different queries often return the
+    same summary, so each distinct summary text is split into
+    sentences only once.  Its candidates depend on the query only
+    through which of its words appear in the query, so they're found
+    once for each distinct set of such words, with the total score of
+    the queries which share it.
+    """
+    texts = []
+    query_scores_of = {}
+    for (text, query, score) in summaries:
+        if text not in query_scores_of:
+            texts.append(text)
+            query_scores_of[text] = defaultdict(int)
+        query_scores_of[text][query] += score
+    for text in texts:
+        query_scores = query_scores_of[text]
+        sentences = text_sentences(text)
+        words = set(word for sentence in sentences
+                    for word in sentence.split())
+        groups = {}
+        for (query, score) in query_scores.iteritems():
+            filtered = frozenset(word for word in words
+                                 if word.lower() in query)
+            if filtered in groups:
+                groups[filtered][1] += score
+            else:
+                groups[filtered] = [query, score]
+        for (query, score) in groups.itervalues():
+            for sentence in sentences:
+                for ngram in candidate_answers(sentence, query):
+                    yield (ngram, score)
+
+def parallel_ranked_answers(summaries, processes):
+    """
+    Return the same result as `ranked_answers(answer_weights(summaries))`,
+    computed by a pool of `processes` processes in two rounds.  In the
+    first, `summaries` is split into shards, and each shard's
+    candidate answers are weighted and split into partitions by the
+    hash of the n-gram (see `partition_weights`).  In the second, each
+    partition's weights are summed, scored and sorted by one process
+    (see `rank_partition`).  The partitions hold disjoint sets of
+    n-grams, so the sorted slices are merged to give the final
+    ranking.  Query scores are integers, so the sums don't depend on
+    the order of addition.
+    """
+    num_shards = 4*processes
+    num_partitions = 4*processes
+    shards = [[] for j in range(num_shards)]
+    for summary in summaries:
+        # Copies of a summary go to the same shard, so they're only
+        # processed once
+        shards[hash(summary[0]) % num_shards].append(summary)
+    pool = scoring_pool(processes)
+    partitions = [[] for j in range(num_partitions)]
+    for pickled_partitions in pool.imap_unordered(
+            partition_weights,
+            [(shard, num_partitions) for shard in shards if shard]):
+        for (j, pickled_weights) in enumerate(pickled_partitions):
+            partitions[j].append(pickled_weights)
+    slices = pool.map(
+        rank_partition,
+        [(partition, CAPITALIZATION_FACTOR) for partition in partitions])
+    return [(answer, -negative_score) for (negative_score, answer)
+            in heapq.merge(*slices)]
+
+def partition_weights(args):
+    """
+    Return a list of `num_partitions` pickled dicts, which together
+    hold `answer_weights(summaries)`, with each n-gram in partition
+    `hash(ngram) % num_partitions`.  The dicts are pickled here, so
+    the parent process passes them on to `rank_partition` without
+    unpickling them.  `args` is the tuple `(summaries, num_partitions)`.
+    """
+    (summaries, num_partitions) = args
+    partitions = [defaultdict(int) for j in range(num_partitions)]
+    for (ngram, weight) in weighted_candidates(summaries):
+        partitions[hash(ngram) % num_partitions][ngram] += weight
+    return [pickle.dumps(dict(partition), pickle.HIGHEST_PROTOCOL)
+            for partition in partitions]
+
+def rank_partition(args):
+    """
+    Return a sorted list of tuples `(-score, answer)` for the n-grams
+    in the pickled dicts `pickled_partitions`, after summing their
+    weights, as in `ranked_answers`.  Words contain only letters, so
+    sorting on the answer text breaks ties in the same order as
+    sorting on the n-gram.  `args` is the tuple `(pickled_partitions,
+    capitalization_factor)`.
+    """
+    (pickled_partitions, capitalization_factor) = args
+    weights = defaultdict(int)
+    for pickled_weights in pickled_partitions:
+        for (ngram, weight) in pickle.loads(pickled_weights).iteritems():
+            weights[ngram] += weight
+    return sorted((-ngram_score(ngram, weight, capitalization_factor),
+                   " ".join(ngram))
+                  for (ngram, weight) in weights.iteritems())
+
+#### Pools of scoring processes, keyed by size.  Creating a pool is
+#### slow, so they're reused.
+_scoring_pools = {}
+_scoring_pools_lock = threading.Lock()
+
+def scoring_pool(processes):
+    """
+    Return a pool of `processes` processes for scoring summaries.
+    """
+    with _scoring_pools_lock:
+        if processes not in _scoring_pools:
+            _scoring_pools[processes] = multiprocessing.Pool(processes)
+        return _scoring_pools[processes]
+
+def ranked_answers(weights):
+    """
+    Return a list of `(answer, score)` tuples for the candidate
+    answers in the dict `weights`, as returned by `answer_weights`.
+    The list is ordered by decreasing score, with ties broken by the
+    n-gram, so the order doesn't depend on how `weights` was built.
+    """
+    ngrams_with_scores = sorted(
+        ((ngram, ngram_score(ngram, weight))
+         for (ngram, weight) in weights.iteritems()),
+        key=lambda x: (-x[1], x[0]))
     return [(" ".join(ngram), score) 
             for (ngram, score) in ngrams_with_scores]
 
@@ -126,16 +599,29 @@ def rewritten_queries(question):
     verb = tq[1] # the simplest assumption, something to improve
     rewrites.append(
         RewrittenQuery("\"%s %s\"" % (verb, " ".join(tq[2:])), 
-                       QUOTED_QUERY_SCORE))
+                       QUOTED_QUERY_SCORE, "quoted:0"))
     for j in range(2, len(tq)):
         rewrites.append(
             RewrittenQuery(
                 "\"%s %s %s\"" % (
                     " ".join(tq[2:j+1]), verb, " ".join(tq[j+1:])),
-                QUOTED_QUERY_SCORE))
-    rewrites.append(RewrittenQuery(" ".join(tq[2:]), UNQUOTED_QUERY_SCORE))
+                QUOTED_QUERY_SCORE,
+                "quoted:end" if j == len(tq)-1 else "quoted:%s" % (j-1)))
+    rewrites.append(RewrittenQuery(" ".join(tq[2:]), UNQUOTED_QUERY_SCORE,
+                                   "unquoted"))
     return rewrites
 
+def planned_queries(question, budget=None):
+    """
+    Return the RewrittenQuery objects for `question` to send to
+    Google.  If `budget` (default `QUERY_BUDGET`) is positive, PLANNER
+    picks at most that many, with the highest yield patterns.
+    Otherwise all of them are returned.
+    """
+    if budget is None:
+        budget = QUERY_BUDGET
+    return PLANNER.plan(rewritten_queries(question), budget)
+
 def tokenize(question):
     """
     Return a list containing a tokenized form of `question`.  Works by
@@ -153,31 +639,119 @@ class RewrittenQuery():
     rewritten query, which is sent to Google; and a score, indicating
     how much weight to give to the answers.  The score is used because
     some queries are much more likely to give highly relevant answers
-    than others.
+    than others.  Instances also record the pattern used to make the
+    query, as described in `planner.py`.
     """
 
-    def __init__(self, query, score):
+    def __init__(self, query, score, pattern=None):
         self.query = query
         self.score = score
+        self.pattern = pattern
+
+
+#### Per-thread counts of cache hits and misses, so callers can report
+#### whether an answer was served from the cache
+cache_stats = threading.local()
+
+def reset_cache_stats():
+    """
+    Reset the cache hit and miss counts for the current thread.
+    """
+    cache_stats.hits = 0
+    cache_stats.misses = 0
+
+def record_cache_lookup(hit):
+    """
+    Record a cache hit (if `hit` is True) or miss for the current
+    thread.
+    """
+    if not hasattr(cache_stats, "hits"):
+        reset_cache_stats()
+    if hit:
+        cache_stats.hits += 1
+    else:
+        cache_stats.misses += 1
 
+#### Per-thread counts of failed calls to each upstream source.  Some
+#### failures, e.g., from Wolfram Alpha, give a null answer instead of
+#### raising an exception, so callers check these counts to tell them
+#### apart from a real lack of an answer.
+upstream_errors = threading.local()
 
-def get_summaries(query, source="google"):
+def reset_upstream_errors():
     """
-    Return a list of the top 10 summaries associated to the results
-    for `query` returned by `source`.  Returns all available summaries
-    if there are fewer than 10 summaries available.  Note that these
+    Reset the upstream error counts for the current thread.
+    """
+    upstream_errors.counts = defaultdict(int)
+
+def record_upstream_error(source):
+    """
+    Record a failed call to `source` ("google" or "wolfram") for the
+    current thread.
+    """
+    if not hasattr(upstream_errors, "counts"):
+        reset_upstream_errors()
+    upstream_errors.counts[source] += 1
+
+def get_summaries(query, source="google", deadline=None, depth=None):
+    """
+    Return a list of the top `depth` summaries associated to the
+    results for `query` returned by `source`, where `depth` defaults
+    to FETCH_DEPTH.  Returns all available summaries if there are
+    fewer than `depth` summaries available.  Note that these
     summaries are returned as BeautifulSoup.BeautifulSoup objects, and
     may need to be manipulated further to extract text, links, etc.
     Note also that we use GOOGLE_CACHE to cache old results, and will
-    preferentially retrieve from the cache, whenever possible.
-    """
-    GOOGLE_CACHE.key = query
-    if GOOGLE_CACHE.exists():
-        return pickle.loads(GOOGLE_CACHE.get_contents_as_string())
+    preferentially retrieve from the cache, whenever possible.  If
+    only a shallower result is cached, we fetch just the summaries
+    it's missing.  Raises DeadlineExceeded if `deadline` passes.  We
+    can't pass a timeout to S3, so the cache is only consulted while
+    there is time left.
+    """
+    if depth is None:
+        depth = FETCH_DEPTH
+    time_left(deadline)
+    key = summaries_key(query, depth)
+    try:
+        summaries = GOOGLE_CACHE.get(key)
+    except KeyError:
+        record_cache_lookup(False)
     else:
-        results = search(query)
-        GOOGLE_CACHE.set_contents_from_string(pickle.dumps(results))
-        return results
+        record_cache_lookup(True)
+        return [BeautifulSoup.BeautifulSoup(html) for html in summaries]
+    summaries = []
+    for shallower in reversed([d for d in CACHED_DEPTHS if d < depth]):
+        time_left(deadline)
+        try:
+            summaries = GOOGLE_CACHE.get(summaries_key(query, shallower))
+        except KeyError:
+            continue
+        if len(summaries) < shallower: # Google has no more results
+            depth = len(summaries)
+        break
+    results = [BeautifulSoup.BeautifulSoup(html) for html in summaries]
+    if len(results) < depth:
+        try:
+            results.extend(search_pages(
+                query, depth=depth, start=len(results), pause=SEARCH_PAUSE,
+                timeout=time_left(deadline)))
+        except (socket.timeout, urllib2.URLError) as e:
+            if deadline is not None and is_timeout(e):
+                raise DeadlineExceeded()
+            record_upstream_error("google")
+            raise
+    GOOGLE_CACHE.set(key, [unicode(result) for result in results])
+    return results
+
+def summaries_key(query, depth):
+    """
+    Return the GOOGLE_CACHE key for the top `depth` summaries for
+    `query`.  The key for the default depth of 10 is just `query`, so
+    results cached before deeper fetches were possible still count.
+    """
+    if depth == 10:
+        return query
+    return "%s#depth=%s" % (query, depth)
 
 def sentences(summary):
     """
@@ -187,7 +761,14 @@ def sentences(summary):
     only, and all punctuation, numbers and other special characters
     have been removed.
     """
-    text = remove_spurious_words(text_of(summary))
+    return text_sentences(text_of(summary))
+
+def text_sentences(text):
+    """
+    Return a list of the sentences in the summary text `text`, as
+    described in `sentences`.
+    """
+    text = remove_spurious_words(text)
     sentences = [sentence for sentence in text.split(".") if sentence]
     return [re.sub(r"[^a-zA-Z ]", "", sentence) for sentence in sentences]
 
@@ -228,16 +809,19 @@ def ngrams(words, n=1):
     """
     return [tuple(words[j:j+n]) for j in xrange(len(words)-n+1)]
 
-def ngram_score(ngram, score):
+def ngram_score(ngram, score, capitalization_factor=None):
     """
     Return the score associated to `ngram`.  The base score is
     `score`, but it's modified by a factor which is
-    `CAPITALIZATION_FACTOR` to the power of the number of capitalized
-    words.  This biases answers toward proper nouns.
+    `capitalization_factor` (default `CAPITALIZATION_FACTOR`) to the
+    power of the number of capitalized words.  This biases answers
+    toward proper nouns.
     """
+    if capitalization_factor is None:
+        capitalization_factor = CAPITALIZATION_FACTOR
     num_capitalized_words = sum(
         1 for word in ngram if is_capitalized(word)) 
-    return score * (CAPITALIZATION_FACTOR**num_capitalized_words)
+    return score * (capitalization_factor**num_capitalized_words)
 
 def is_capitalized(word):
     """
@@ -245,30 +829,53 @@ def is_capitalized(word):
     """
     return word == word.capitalize()
 
-def wolfram_qa(question):
+def wolfram_qa(question, deadline=None):
     """
     Return Wolfram Alpha's answer to `question`.  Caches results to
     not overuse the Wolfram API.  Note that this is mainly a wrapper
     around `wolfram_qa_uncached`, and more information may be found in
-    that docstring.
+    that docstring.  If the query fails we return None, and don't
+    cache anything, so the query is retried next time, and record the
+    failure with `record_upstream_error`.  Raises DeadlineExceeded if
+    `deadline` passes.
     """
-    WOLFRAM_CACHE.key = question
-    if WOLFRAM_CACHE.exists():
-        return pickle.loads(WOLFRAM_CACHE.get_contents_as_string())
+    time_left(deadline)
+    try:
+        result = WOLFRAM_CACHE.get(question)
+    except KeyError:
+        record_cache_lookup(False)
     else:
-        result = wolfram_qa_uncached(question)
-        WOLFRAM_CACHE.set_contents_from_string(pickle.dumps(result))
+        record_cache_lookup(True)
         return result
+    try:
+        result = wolfram_qa_uncached(question, time_left(deadline))
+    except wolfram_client.WolframTimeout:
+        if deadline is not None and time.time() >= deadline:
+            raise DeadlineExceeded()
+        # The request timed out, but not for want of time
+        record_upstream_error("wolfram")
+        return None
+    except wolfram_client.WolframError:
+        record_upstream_error("wolfram")
+        return None
+    WOLFRAM_CACHE.set(question, result)
+    return result
 
-def wolfram_qa_uncached(question):
+def wolfram_qa_uncached(question, timeout=None):
     """
     Return Wolfram Alpha's answer to `question`.  The answer is
     returned in plain text.  If there is no answer it returns None.
+    Raises a wolfram_client.WolframError if the query fails, or takes
+    longer than `timeout` seconds.
+    """
+    return primary_answer(WOLFRAM_CLIENT.query(question, timeout))
+
+def primary_answer(result):
+    """
+    Return the first line of the plain text of the primary pod in the
+    Wolfram Alpha XML document `result`, or None if there is no
+    primary pod.
     """
-    waeo = wolfram.WolframAlphaEngine(
-        config.WOLFRAM_APPID, wolfram_server)
-    query = waeo.CreateQuery(question)
-    result = waeo.PerformQuery(query)
     waeqr = wolfram.WolframAlphaQueryResult(result)
     try:
         xml_pods = [ElementTree.fromstring(x) for x in waeqr.XMLPods()] 
@@ -287,19 +894,59 @@ def wolfram_qa_uncached(question):
     except IndexError:
         return None
 
-def hybrid_qa(question):
+def hybrid_qa(question, deadline=None):
     """
     Return an answer to `question` using a combination of Google
     search results and Wolfram Alpha.  The procedure is to query Alpha
     and use its answer, falling back to the highest-ranked result
     returned by `google_qa` if Alpha produces no results.  The answer
-    is returned in plain text.
+    is returned in plain text.  If `deadline` passes, we return the
+    best answer found so far, as a PartialAnswer.
     """
-    wolfram_answer = wolfram_qa(question)
+    try:
+        wolfram_answer = wolfram_qa(question, deadline)
+    except DeadlineExceeded:
+        wolfram_answer = None
     if wolfram_answer:
         return wolfram_answer
-    else:
-        return google_qa(question)[0][0]
+    return top_google_answer(question, deadline)
+
+def auto_qa(question, deadline=None):
+    """
+    Return an answer to `question` in the same way as `hybrid_qa`,
+    except that ROUTER is used to skip sources which are unlikely to
+    help.  Wolfram Alpha is skipped if it probably won't answer, and
+    Google is skipped if its answer is probably wrong, in which case
+    we may return None.  As in `hybrid_qa`, Google is still asked if
+    the deadline passes while asking Wolfram Alpha.
+    """
+    tokens = tokenize(question)
+    wolfram_answer = None
+    p_wolfram = ROUTER.probability("wolfram", tokens)
+    if p_wolfram is None or p_wolfram >= WOLFRAM_ROUTE_THRESHOLD:
+        try:
+            wolfram_answer = wolfram_qa(question, deadline)
+        except DeadlineExceeded:
+            wolfram_answer = PartialAnswer()
+        if wolfram_answer:
+            return wolfram_answer
+    p_google = ROUTER.probability("google", tokens)
+    if p_google is not None and p_google < GOOGLE_ROUTE_THRESHOLD:
+        return wolfram_answer if timed_out(wolfram_answer) else None
+    return top_google_answer(question, deadline)
+
+def top_google_answer(question, deadline=None):
+    """
+    Return the highest-ranked answer to `question` returned by
+    `google_qa`.  If `deadline` passes, we return the best answer
+    found so far, as a PartialAnswer.
+    """
+    google_answers = google_qa(question, deadline)
+    if not timed_out(google_answers):
+        return google_answers[0][0]
+    if google_answers:
+        return PartialAnswer(google_answers[0][0])
+    return PartialAnswer()
 
 if __name__ == "__main__":
     pretty_qa("Who ran the first four-minute mile?")
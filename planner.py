@@ -0,0 +1,100 @@
+"""
+planner.py
+~~~~~~~~~~
+
+Chooses which rewritten queries to send to Google, when there's a
+budget on the number of searches per question.
+
+Each RewrittenQuery has a pattern, describing how it was made from
+the question: "quoted:N" for a quoted query with the verb after the
+first N words of the rest of the question, "quoted:end" for a quoted
+query with the verb last, and "unquoted" for the unquoted query.  For
+each pattern we record the number of evaluation questions it was
+tried on, and its total yield, i.e., the fraction of the weight of
+the first correct answer which came from the query with that pattern,
+summed over the questions.  Given a budget, the planner keeps the
+rewrites whose patterns have the highest mean yield.
+
+The statistics are recorded by `evaluation.evaluate`, e.g.:
+
+    evaluation.evaluate("google", planner_file="planner.json")
+"""
+
+#### Library imports
+
+# Standard library
+import hashlib
+import json
+
+
+#### Mean yield assumed for patterns with few trials.  Each pattern's
+#### mean is smoothed as though it had PRIOR_TRIALS extra trials with
+#### this yield.
+PRIOR_YIELD = 0.5
+PRIOR_TRIALS = 1
+
+
+class QueryPlanner():
+    """
+    Yield statistics for rewrite patterns.  `stats` maps each pattern
+    to a list `[trials, total_yield]`.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats or {}
+
+    def record(self, pattern, contribution):
+        """
+        Record a trial of `pattern`, which contributed the fraction
+        `contribution` of the weight of the correct answer.
+        """
+        stats = self.stats.setdefault(pattern, [0, 0.0])
+        stats[0] += 1
+        stats[1] += contribution
+
+    def expected_yield(self, pattern):
+        """
+        Return the smoothed mean yield of `pattern`.
+        """
+        (trials, total_yield) = self.stats.get(pattern, [0, 0.0])
+        return ((total_yield+PRIOR_YIELD*PRIOR_TRIALS) /
+                (trials+PRIOR_TRIALS))
+
+    def plan(self, rewrites, budget):
+        """
+        Return the `budget` rewrites in the list `rewrites` with the
+        highest expected yield, in their original order.  Ties are
+        broken in favour of earlier rewrites.  If `budget` is 0 or
+        None, all the rewrites are returned.
+        """
+        if not budget or len(rewrites) <= budget:
+            return rewrites
+        ranked = sorted(
+            range(len(rewrites)),
+            key=lambda j: (-self.expected_yield(rewrites[j].pattern), j))
+        chosen = set(ranked[:budget])
+        return [rewrite for (j, rewrite) in enumerate(rewrites)
+                if j in chosen]
+
+    def fingerprint(self):
+        """
+        Return a string which changes whenever the statistics change.
+        """
+        return hashlib.sha1(
+            json.dumps(self.stats, sort_keys=True)).hexdigest()[:12]
+
+    def save(self, filename):
+        """
+        Save the statistics to `filename`, as JSON.
+        """
+        with open(filename, "w") as f:
+            json.dump(self.stats, f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Return the QueryPlanner whose statistics were saved in
+        `filename`.
+        """
+        with open(filename) as f:
+            return cls(json.load(f))
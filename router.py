@@ -0,0 +1,153 @@
+"""
+router.py
+~~~~~~~~~
+
+Predicts which sources are worth asking about a question, so
+`mini_qa.qa(question, "auto")` can skip upstream calls which are
+likely to be wasted.  The router holds two naive Bayes classifiers:
+
+1. "wolfram" predicts whether Wolfram Alpha will return an answer at
+   all.
+
+2. "google" predicts whether the top answer from Google will be
+   correct.
+
+The features of a question are its tokens, its length in tokens, and
+its leading verb.  Both classifiers are trained from JSON lines
+results files, in the format written by `batch.py`, or by
+`evaluation.evaluate` (whose records also say whether the answers
+were correct).  Records from Wolfram Alpha train the "wolfram"
+classifier, and records from Google which say whether they were
+correct train the "google" classifier.
+
+Example:
+
+    python router.py router.json evaluation_google.jsonl answers.jsonl
+"""
+
+#### Library imports
+
+# Standard library
+import json
+import math
+import sys
+
+
+#### Classifier labels
+LABELS = ["wolfram", "google"]
+
+
+class Router():
+    """
+    A pair of naive Bayes classifiers, one per label in LABELS.  For
+    each label we store the number of positive and negative examples,
+    and for each feature the number of positive and negative examples
+    in which it occurs.
+    """
+
+    def __init__(self, model=None):
+        self.model = model or dict(
+            (label, {"examples": [0, 0], "features": {}})
+            for label in LABELS)
+
+    def train(self, label, tokens, outcome):
+        """
+        Record an example for `label`: the question with the token list
+        `tokens` had the boolean `outcome`.
+        """
+        model = self.model[label]
+        outcome = int(bool(outcome))
+        model["examples"][outcome] += 1
+        for feature in features(tokens):
+            counts = model["features"].setdefault(feature, [0, 0])
+            counts[outcome] += 1
+
+    def num_examples(self, label):
+        """
+        Return the number of examples recorded for `label`.
+        """
+        return sum(self.model[label]["examples"])
+
+    def probability(self, label, tokens):
+        """
+        Return the probability that the outcome for `label` is True for
+        the question with token list `tokens`.  Returns None if there
+        are no examples for `label`.
+        """
+        model = self.model[label]
+        examples = model["examples"]
+        if sum(examples) == 0:
+            return None
+        log_odds = math.log((examples[1]+1.0)/(examples[0]+1.0))
+        for feature in features(tokens):
+            # Laplace smoothing, so unseen features are neutral
+            counts = model["features"].get(feature, [0, 0])
+            log_odds += math.log(
+                ((counts[1]+1.0)/(examples[1]+2.0)) /
+                ((counts[0]+1.0)/(examples[0]+2.0)))
+        if log_odds > 50:
+            return 1.0
+        return 1.0-1.0/(1.0+math.exp(log_odds))
+
+    def save(self, filename):
+        """
+        Save the model to `filename`, as JSON.
+        """
+        with open(filename, "w") as f:
+            json.dump(self.model, f)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Return the Router whose model was saved in `filename`.
+        """
+        with open(filename) as f:
+            return cls(json.load(f))
+
+
+def features(tokens):
+    """
+    Return the set of features of a question with the token list
+    `tokens`, as returned by `mini_qa.tokenize`.
+    """
+    result = set("token:"+token for token in tokens)
+    result.add("length:%s" % min(len(tokens), 12))
+    if len(tokens) > 1:
+        result.add("verb:"+tokens[1])
+    return result
+
+def train(filenames, tokenize):
+    """
+    Return a Router trained from the JSON lines results files
+    `filenames`.  `tokenize` is used to tokenize questions.
+    """
+    router = Router()
+    for filename in filenames:
+        with open(filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "error" in record or record.get("timed_out"):
+                    continue
+                tokens = tokenize(record["question"])
+                if record.get("source") == "wolfram":
+                    router.train("wolfram", tokens, record.get("answer"))
+                if record.get("source") == "google" and "correct" in record:
+                    router.train("google", tokens, record["correct"])
+    return router
+
+def main():
+    if len(sys.argv) < 3:
+        print "Usage: python router.py MODEL_FILE RESULTS_FILE..."
+        sys.exit(1)
+    import mini_qa
+    router = train(sys.argv[2:], mini_qa.tokenize)
+    router.save(sys.argv[1])
+    for label in LABELS:
+        print "Trained %s classifier on %s examples" % (
+            label, router.num_examples(label))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+scoring_benchmark.py
+~~~~~~~~~~~~~~~~~~~~
+
+Times scoring Google summaries in one process, with `answer_weights`
+and `ranked_answers`, against scoring them with a pool of processes,
+with `parallel_ranked_answers`, on synthetic summaries.  It also
+checks that both give exactly the same ranking.
+
+Example:
+
+    python scoring_benchmark.py -n 6000 -p 1 2 4 8
+"""
+
+#### Library imports
+from __future__ import division
+import mini_qa
+
+# Standard library
+import argparse
+import random
+import time
+
+
+def main():
+    args = parse_args()
+    summaries = synthetic_summaries(args.num, args.vocabulary)
+    start = time.time()
+    expected = mini_qa.ranked_answers(mini_qa.answer_weights(summaries))
+    serial = time.time()-start
+    print "%s summaries, %s distinct answers" % (len(summaries),
+                                                 len(expected))
+    print "processes  seconds  speedup  same ranking"
+    print "serial     %7.3f  %7.2f" % (serial, 1.0)
+    for processes in args.processes:
+        mini_qa.scoring_pool(processes) # don't time starting the pool
+        start = time.time()
+        answers = mini_qa.parallel_ranked_answers(summaries, processes)
+        seconds = time.time()-start
+        print "%-9d  %7.3f  %7.2f  %s" % (
+            processes, seconds, serial/seconds, answers == expected)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark serial and parallel scoring of summaries.")
+    parser.add_argument("-n", "--num", type=int, default=6000,
+                        help="number of summaries")
+    parser.add_argument("-p", "--processes", type=int, nargs="+",
+                        default=[1, 2, 4, 8],
+                        help="numbers of scoring processes")
+    parser.add_argument("-v", "--vocabulary", type=int, default=5000,
+                        help="number of distinct words in the summaries")
+    return parser.parse_args()
+
+def synthetic_summaries(num, vocabulary, seed=0):
+    """
+    Return a list of `num` tuples `(text, query, score)`, as returned
+    by `mini_qa.google_summaries`, with random text drawn from
+    `vocabulary` made-up words, some capitalized.
+    """
+    generator = random.Random(seed)
+    words = ["w%s" % j for j in range(vocabulary)]
+    words = [word.capitalize() if j % 5 == 0 else word
+             for (j, word) in enumerate(words)]
+    words = ["".join(chr(ord("a")+int(c)) if c.isdigit() else c
+                     for c in word) for word in words]
+    queries = [("\"wrote the iliad\"", mini_qa.QUOTED_QUERY_SCORE),
+               ("\"the wrote iliad\"", mini_qa.QUOTED_QUERY_SCORE),
+               ("the iliad", mini_qa.UNQUOTED_QUERY_SCORE)]
+    summaries = []
+    for j in range(num):
+        text = ". ".join(" ".join(generator.choice(words)
+                                  for k in range(10)) for l in range(3))
+        (query, score) = generator.choice(queries)
+        summaries.append((text, query, score))
+    return summaries
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+snapshot.py
+~~~~~~~~~~~
+
+Portable snapshots of the Google and Wolfram Alpha caches, used to
+provision new machines with a warm cache.
+
+A snapshot is a single file.  It starts with a header, followed by
+the entries, each compressed separately with zlib, followed by an
+index of fixed-size records `(hash, offset, length)`, sorted by hash.
+The file is memory-mapped and searched in place, so a snapshot can be
+used at startup without unpacking it, and only the pages holding the
+entries actually read are loaded into memory.
+
+Usage:
+
+    python snapshot.py export cache.snapshot
+    python snapshot.py import cache.snapshot
+    python snapshot.py info cache.snapshot
+
+`export` packs the current caches into a snapshot, and `import` copies
+the entries of a snapshot into the caches.  Neither is needed to use
+a snapshot: `mini_qa` reads from `SNAPSHOT_PATH` if it exists.
+"""
+
+#### Library imports
+
+# Standard library
+import hashlib
+import json
+import mmap
+from multiprocessing.pool import ThreadPool
+import os
+import struct
+import sys
+import zlib
+
+
+#### Header: magic string, number of entries, offset of the index
+MAGIC = "MQSNAP01"
+HEADER = struct.Struct("<8sQQ")
+
+#### Index records: hash of the key, offset and length of the entry
+RECORD = struct.Struct("<QQI")
+
+
+class Snapshot():
+    """
+    A read-only, memory-mapped snapshot stored in `filename`.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.num_entries, self.index_offset) = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a snapshot" % filename)
+
+    def __len__(self):
+        return self.num_entries
+
+    def record(self, j):
+        """
+        Return the `j`th index record, `(hash, offset, length)`.
+        """
+        return RECORD.unpack_from(self.map, self.index_offset+j*RECORD.size)
+
+    def get(self, cache_name, name):
+        """
+        Return the value stored for `name` in the cache called
+        `cache_name`.  Raises KeyError if there's no such entry.
+        """
+        target = key_hash(cache_name, name)
+        lo, hi = 0, self.num_entries
+        while lo < hi:
+            mid = (lo+hi) // 2
+            if self.record(mid)[0] < target:
+                lo = mid+1
+            else:
+                hi = mid
+        # Distinct keys may share a hash, so check each candidate
+        for j in xrange(lo, self.num_entries):
+            (hash_, offset, length) = self.record(j)
+            if hash_ != target:
+                break
+            (entry_cache, entry_name, value) = read_entry(
+                self.map, offset, length)
+            if entry_cache == cache_name and entry_name == name:
+                return value
+        raise KeyError(name)
+
+    def entries(self):
+        """
+        Generate tuples `(cache_name, name, value)` for every entry.
+        """
+        for j in xrange(self.num_entries):
+            (hash_, offset, length) = self.record(j)
+            yield read_entry(self.map, offset, length)
+
+    def close(self):
+        """
+        Unmap the snapshot file.
+        """
+        self.map.close()
+
+
+def key_hash(cache_name, name):
+    """
+    Return a 64-bit hash of the key `name` in the cache `cache_name`.
+    """
+    if isinstance(name, unicode):
+        name = name.encode("utf-8")
+    return struct.unpack(
+        "<Q", hashlib.sha1(cache_name+"\0"+name).digest()[:8])[0]
+
+def read_entry(data, offset, length):
+    """
+    Return the entry `(cache_name, name, value)` stored at `offset` in
+    `data`.
+    """
+    return tuple(json.loads(zlib.decompress(data[offset:offset+length])))
+
+def export(filename, caches, workers=8):
+    """
+    Write a snapshot of `caches`, a dict mapping names to
+    `cache.Cache` instances, to `filename`.  Entries are fetched by
+    `workers` threads in parallel.  The file is replaced atomically.
+    Return the number of entries written.
+    """
+    temp = "%s.%s.tmp" % (filename, os.getpid())
+    index = []
+    pool = ThreadPool(workers)
+    try:
+        with open(temp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, 0, 0))
+            for (cache_name, cache) in sorted(caches.items()):
+                names = [key.name for key in cache.bucket.list()]
+                def fetch(name):
+                    try:
+                        value = cache.fetch(name, touch=False)
+                    except KeyError: # deleted since the listing
+                        return None
+                    return zlib.compress(json.dumps([cache_name, name, value]))
+                for (name, data) in zip(
+                        names, pool.imap(fetch, names, chunksize=16)):
+                    if data is None:
+                        continue
+                    index.append((key_hash(cache_name, name), f.tell(),
+                                  len(data)))
+                    f.write(data)
+            index.sort()
+            index_offset = f.tell()
+            for record in index:
+                f.write(RECORD.pack(*record))
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, len(index), index_offset))
+    finally:
+        pool.close()
+    os.rename(temp, filename)
+    return len(index)
+
+def import_snapshot(filename, caches, workers=8):
+    """
+    Copy every entry of the snapshot in `filename` into `caches`, a
+    dict mapping names to `cache.Cache` instances.  Return the number
+    of entries copied.
+    """
+    snapshot = Snapshot(filename)
+    def store(entry):
+        (cache_name, name, value) = entry
+        caches[cache_name].set(name, value)
+    pool = ThreadPool(workers)
+    try:
+        for _ in pool.imap_unordered(store, snapshot.entries(),
+                                     chunksize=16):
+            pass
+    finally:
+        pool.close()
+        snapshot.close()
+    return len(snapshot)
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] not in ("export", "import", "info"):
+        print "Usage: python snapshot.py export|import|info FILENAME"
+        sys.exit(1)
+    (command, filename) = sys.argv[1:]
+    if command == "info":
+        snapshot = Snapshot(filename)
+        print "%s entries, %s bytes" % (len(snapshot),
+                                        os.path.getsize(filename))
+        return
+    import mini_qa
+    caches = {"google": mini_qa.GOOGLE_CACHE,
+              "wolfram": mini_qa.WOLFRAM_CACHE}
+    if command == "export":
+        print "Exported %s entries" % export(filename, caches)
+    else: # assume command == "import"
+        print "Imported %s entries" % import_snapshot(filename, caches)
+
+if __name__ == "__main__":
+    main()
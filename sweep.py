@@ -0,0 +1,167 @@
+"""
+sweep.py
+~~~~~~~~
+
+Sweeps the parameters used to score Google-based answers
+(`CAPITALIZATION_FACTOR`, `QUOTED_QUERY_SCORE` and
+`UNQUOTED_QUERY_SCORE` in `mini_qa.py`), and reports how well each
+combination of parameters does on the questions in qa_pairs.json.
+
+The expensive part of answering a question (fetching summaries,
+splitting sentences and extracting n-grams) doesn't depend on the
+parameters at all.  So we do it just once per question, and record
+for each candidate n-gram the number of times it occurs in results
+for quoted and unquoted queries, and the number of capitalized words
+it contains.  The score for any combination of parameters is then a
+simple function of those features, which we evaluate for thousands
+of combinations at once using NumPy.
+"""
+
+#### Library imports
+from __future__ import division
+import evaluation
+import mini_qa
+
+# Standard library
+import itertools
+
+# Third-party libraries
+import numpy as np
+
+
+#### Default parameter grids to sweep over
+CAPITALIZATION_FACTORS = np.linspace(1.0, 4.0, 31)
+QUOTED_QUERY_SCORES = np.linspace(1.0, 10.0, 19)
+UNQUOTED_QUERY_SCORES = np.linspace(0.0, 5.0, 11)
+
+#### The largest number of (parameter combination, n-gram) scores we
+#### hold in memory at once.  Larger values are faster, but use more
+#### memory (8 bytes per score).
+MAX_CELLS = 2**23
+
+#### Only answers ranked in the top `TOP` count as okay, matching
+#### `evaluation.answers`
+TOP = 20
+
+
+class QuestionFeatures():
+    """
+    Stores the features of all the candidate answers to a question.
+    `occurrences` is an array with one row per candidate n-gram, whose
+    two columns are the number of times the n-gram occurred in results
+    for quoted and unquoted queries, respectively.  `capitals` is the
+    number of capitalized words in each n-gram, and `correct` records
+    whether each n-gram is an acceptable answer.  The n-grams are in
+    sorted order.
+    """
+    def __init__(self, occurrences, capitals, correct):
+        self.occurrences = occurrences
+        self.capitals = capitals
+        self.correct = correct
+
+
+def main():
+    features = [question_features(qa_pair.question, qa_pair.answers)
+                for qa_pair in evaluation.load_qa_pairs()]
+    results = sweep(features)
+    report(results, len(features))
+
+def question_features(question, acceptable_answers):
+    """
+    Return a QuestionFeatures instance for the candidate answers
+    `mini_qa.google_qa` would generate for `question`.
+    """
+    counts = {}
+    for query in mini_qa.rewritten_queries(question):
+        column = 0 if is_quoted(query) else 1
+        for summary in mini_qa.get_summaries(query.query):
+            for sentence in mini_qa.sentences(summary):
+                for ngram in mini_qa.candidate_answers(sentence, query.query):
+                    counts.setdefault(ngram, [0, 0])[column] += 1
+    # Sorted, so the index of an n-gram gives its place among n-grams
+    # with the same score, as in `mini_qa.ranked_answers`
+    ngrams = sorted(counts)
+    occurrences = np.array([counts[ngram] for ngram in ngrams],
+                           dtype=float).reshape(-1, 2)
+    capitals = np.array(
+        [sum(1 for word in ngram if mini_qa.is_capitalized(word))
+         for ngram in ngrams], dtype=int)
+    correct = np.array([" ".join(ngram) in acceptable_answers
+                        for ngram in ngrams], dtype=bool)
+    return QuestionFeatures(occurrences, capitals, correct)
+
+def is_quoted(query):
+    """
+    Return True if the RewrittenQuery `query` is a quoted query, and
+    so is weighted by `QUOTED_QUERY_SCORE`.
+    """
+    return query.query.startswith("\"")
+
+def sweep(features,
+          capitalization_factors=CAPITALIZATION_FACTORS,
+          quoted_scores=QUOTED_QUERY_SCORES,
+          unquoted_scores=UNQUOTED_QUERY_SCORES):
+    """
+    Score every combination of the given parameter values against the
+    list `features` of QuestionFeatures instances.  Return a tuple
+    `(grid, perfect, okay, rank_sum)`.  `grid` is an array with one
+    row `(capitalization_factor, quoted_score, unquoted_score)` per
+    combination, and the other entries are arrays giving, for each
+    combination, the number of questions with a perfect answer, the
+    number with a correct answer in the top 20, and the sum of the
+    ranks of those top 20 answers.
+
+    Ties are broken by the n-gram, as in `mini_qa.ranked_answers`, so
+    the ranks match those `evaluation.evaluate` reports.
+    """
+    grid = np.array(list(itertools.product(
+        capitalization_factors, quoted_scores, unquoted_scores)))
+    perfect = np.zeros(len(grid), dtype=int)
+    okay = np.zeros(len(grid), dtype=int)
+    rank_sum = np.zeros(len(grid), dtype=int)
+    # One row per combination, one column per possible number of
+    # capitalized words in a 1-, 2- or 3-gram
+    capitalization_powers = grid[:, :1]**np.arange(4)
+    for f in features:
+        if not f.correct.any():
+            continue
+        step = max(1, MAX_CELLS // len(f.capitals))
+        for start in xrange(0, len(grid), step):
+            chunk = slice(start, start+step)
+            weights = np.dot(grid[chunk, 1:], f.occurrences.T)
+            scores = weights * capitalization_powers[chunk][:, f.capitals]
+            ranks = None
+            for j in np.flatnonzero(f.correct):
+                # Candidates ranked above the correct answer j: those
+                # with a higher score, and those with the same score
+                # and an earlier n-gram
+                score = scores[:, j:j+1]
+                rank = ((scores > score).sum(axis=1) +
+                        (scores[:, :j] == score).sum(axis=1))
+                ranks = rank if ranks is None else np.minimum(ranks, rank)
+            in_top = ranks < TOP
+            perfect[chunk] += (ranks == 0)
+            okay[chunk] += in_top
+            rank_sum[chunk] += np.where(in_top, ranks, 0)
+    return grid, perfect, okay, rank_sum
+
+def report(results, num_questions, num=20):
+    """
+    Print the `num` best parameter combinations in `results`, as
+    returned by `sweep`.  Combinations are ordered by the number of
+    perfect answers, then by the number of correct answers in the top
+    20, then by average rank.
+    """
+    grid, perfect, okay, rank_sum = results
+    average_rank = rank_sum / np.maximum(okay, 1)
+    order = np.lexsort((average_rank, -okay, -perfect))
+    print "Swept {} parameter combinations over {} questions".format(
+        len(grid), num_questions)
+    print "capitalization  quoted  unquoted  perfect  top 20  avg. rank"
+    for j in order[:num]:
+        print "{:14.2f}  {:6.2f}  {:8.2f}  {:7d}  {:6d}  {:9.2f}".format(
+            grid[j, 0], grid[j, 1], grid[j, 2], perfect[j], okay[j],
+            average_rank[j])
+
+if __name__ == "__main__":
+    main()
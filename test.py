@@ -10,8 +10,15 @@ from mini_qa import *
 
 # Standard library
 import json
+import os
+import shutil
+import tempfile
 import traceback
 
+# My libraries
+import bloom
+import transport
+
 failed_tests = 0
 
 def test(code, result=None):
@@ -52,6 +59,177 @@ test("is_capitalized('Hello')", "True")
 
 test("is_capitalized('hello')", "False")
 
+test("answer_cache_key('Who wrote  the Iliad?', 'google') == answer_cache_key('who wrote the Iliad', 'google')",
+     "True")
+
+test("ranked_answers({('Ada',): 2, ('b',): 3, ('a',): 3})",
+     "[('Ada', 4.4), ('a', 3.0), ('b', 3.0)]")
+
+test("parallel_ranked_answers([('The Count. Ada Lovelace', 'count', 5), ('Ada wrote', 'count', 2)], 2) == ranked_answers(answer_weights([('The Count. Ada Lovelace', 'count', 5), ('Ada wrote', 'count', 2)]))",
+     "True")
+
+test("sorted(router.features(['who', 'wrote', 'hamlet']))",
+     "['length:3', 'token:hamlet', 'token:who', 'token:wrote', 'verb:wrote']")
+
+def space_saving_top(items, capacity):
+    """
+    Return the top items found by a SpaceSaving sketch with the given
+    `capacity`.
+    """
+    sketch = SpaceSaving(capacity)
+    for item in items:
+        sketch.add(item)
+    return sketch.top()
+
+test("space_saving_top('aabacaa', 2)", "[('a', 5, 0), ('c', 2, 1)]")
+
+test("answer_weights([('Ada Lovelace. The Count', 'count', 5), ('Ada Lovelace. The Count', '\"count ada\"', 2), ('Ada Lovelace. The Count', 'count', 5)]) == {('Ada',): 10, ('Lovelace',): 12, ('Ada', 'Lovelace'): 10, ('The',): 12}",
+     "True")
+
+test("[query.pattern for query in QueryPlanner({'quoted:0': [4, 0.0], 'unquoted': [4, 3.0]}).plan(rewritten_queries('Who wrote the Iliad'), 2)]",
+     "['quoted:1', 'unquoted']")
+
+def bloom_round_trip(keys, probes):
+    """
+    Save a BloomFilter holding `keys`, load it again, and return
+    whether each of `probes` is in the loaded filter.
+    """
+    bloom_filter = bloom.BloomFilter(100)
+    for key in keys:
+        bloom_filter.add(key)
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "filter.bloom")
+        bloom_filter.save(filename)
+        loaded = bloom.BloomFilter.load(filename)
+    finally:
+        shutil.rmtree(directory)
+    return [probe in loaded for probe in probes]
+
+test("bloom_round_trip(['Iliad', u'Odyss\\xe9e'], ['Iliad', u'Odyss\\xe9e', 'Aeneid'])",
+     "[True, True, False]")
+
+class FakeCache():
+    """
+    Stands in for a `cache.Cache`, holding the dict `values` in place
+    of an S3 bucket.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.bucket = self
+
+    def list(self):
+        return [FakeKey(name) for name in sorted(self.values)]
+
+    def fetch(self, name, touch=True):
+        return self.values[name]
+
+
+class FakeKey():
+    """
+    Stands in for a `boto` key listed by `FakeCache`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+def snapshot_lookups(caches, lookups):
+    """
+    Export a snapshot of `caches`, a dict mapping names to dicts of
+    values, then look up each `(cache_name, name)` in `lookups`,
+    returning None for missing entries.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "cache.snapshot")
+        snapshot.export(filename, dict(
+            (cache_name, FakeCache(values))
+            for (cache_name, values) in caches.items()))
+        snap = snapshot.Snapshot(filename)
+        results = []
+        for (cache_name, name) in lookups:
+            try:
+                results.append(snap.get(cache_name, name))
+            except KeyError:
+                results.append(None)
+        snap.close()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+test("snapshot_lookups({'google': {'iliad': ['Homer'], 'aeneid': ['Virgil']}, 'wolfram': {'iliad': 'Homer'}}, [('google', 'aeneid'), ('wolfram', 'iliad'), ('wolfram', 'aeneid')])",
+     "[['Virgil'], 'Homer', None]")
+
+def transport_round_trip(body):
+    """
+    Record fetching a local file containing `body`, then replay it.
+    Return the replayed body, and whether replaying a request missing
+    from the archive raised ReplayMiss.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        page = os.path.join(directory, "page.html")
+        with open(page, "w") as f:
+            f.write(body)
+        archive = os.path.join(directory, "archive.gz")
+        url = "file://"+page
+        transport.Transport("record", archive).urlopen(url).read()
+        replay = transport.Transport("replay", archive)
+        replayed = replay.urlopen(url).read()
+        try:
+            replay.urlopen(url+"?missing")
+            missed = False
+        except transport.ReplayMiss:
+            missed = True
+    finally:
+        shutil.rmtree(directory)
+    return [replayed, missed]
+
+test("transport_round_trip('<p>Homer</p>')", "['<p>Homer</p>', True]")
+
+def wolfram_error(result):
+    """
+    Return the message and code of the WolframAPIError raised by
+    `wolfram_client.check_result` for `result`, or None.
+    """
+    try:
+        wolfram_client.check_result(result)
+    except wolfram_client.WolframAPIError as e:
+        return [str(e), e.code]
+    return None
+
+test("wolfram_error('<queryresult success=\"true\" error=\"false\"/>')", "None")
+
+test("wolfram_error('<queryresult error=\"true\"><error><code>1</code><msg>Invalid appid</msg></error></queryresult>')",
+     "['Invalid appid', 1]")
+
+test("wolfram_error('<queryresult')[1]", "None")
+
+test("[summaries_key('who wrote the iliad', depth) for depth in (10, 30)]",
+     "['who wrote the iliad', 'who wrote the iliad#depth=30']")
+
+def lru_cache_keys(size, sizeof, operations):
+    """
+    Apply `operations` to an LRUCache of the given `size` and `sizeof`,
+    and return the keys left, from least to most recently used.  Each
+    operation is `(key, value)` to set a value, or `(key,)` to get one.
+    """
+    lru = cache.LRUCache(size, sizeof)
+    for operation in operations:
+        if len(operation) == 2:
+            lru.set(*operation)
+        else:
+            lru.get(operation[0])
+    return list(lru.entries)
+
+test("lru_cache_keys(2, None, [('a', 1), ('b', 2), ('a',), ('c', 3)])",
+     "['a', 'c']")
+
+test("lru_cache_keys(4, len, [('a', 'xx'), ('b', 'x'), ('c', 'xx'), ('d', 'xxxxx')])",
+     "['b', 'c']")
+
 def test_qa_pairs():
     """
     Count the number of question-answer pairs in the qa_pairs.json
@@ -0,0 +1,222 @@
+"""
+transport.py
+~~~~~~~~~~~~
+
+The HTTP transport used by `google.py` and `wolfram.py`.  There are
+three modes:
+
+1. "live": requests go to the network, as usual.
+
+2. "record": requests go to the network, and the responses are
+   appended to an archive, a gzipped file of JSON lines.
+
+3. "replay": responses are served from an archive, without touching
+   the network.  Optionally, each response is delayed, either by a
+   fixed number of seconds, or by the time the original request took.
+
+The mode can be set with `install`, or with the environment variable
+`MINI_QA_TRANSPORT`, e.g. "record:traffic.gz", "replay:traffic.gz" or
+"replay:traffic.gz:recorded" (to simulate the recorded latencies) or
+"replay:traffic.gz:0.2" (to add 0.2 seconds per request).
+"""
+
+#### Library imports
+
+# Standard library
+import base64
+import gzip
+import hashlib
+import json
+import mimetools
+import os
+import socket
+from StringIO import StringIO
+import threading
+import time
+import urllib
+import urllib2
+
+
+#### Value of `latency` which replays responses with the latency
+#### they were recorded with
+RECORDED = "recorded"
+
+
+class ReplayMiss(urllib2.URLError):
+    """
+    Raised in replay mode when a request isn't in the archive.
+    """
+    pass
+
+
+class Transport():
+    """
+    Opens URLs in the given `mode`, recording to or replaying from the
+    file `archive`.  `latency` is only used in replay mode, and is
+    None (no delay), a number of seconds, or RECORDED.
+    """
+
+    def __init__(self, mode="live", archive=None, latency=None):
+        if mode not in ("live", "record", "replay"):
+            raise ValueError("Unknown transport mode: %s" % mode)
+        if mode != "live" and not archive:
+            raise ValueError("The %s mode needs an archive" % mode)
+        self.mode = mode
+        self.archive = archive
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.records = {}
+        if mode == "replay":
+            self.records = load_archive(archive)
+
+    def urlopen(self, request, data=None, timeout=None):
+        """
+        Open `request`, a URL or urllib2.Request, sending `data` (if
+        any) as the body.  Works like `urllib2.urlopen`.
+        """
+        if timeout is None:
+            timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+        if self.mode == "live":
+            return urllib2.urlopen(request, data, timeout)
+        if self.mode == "record":
+            return self.record(request, data, timeout)
+        return self.replay(request, data, timeout)
+
+    def record(self, request, data, timeout):
+        """
+        Open `request` over the network, and append the response to
+        the archive.
+        """
+        start = time.time()
+        try:
+            response = urllib2.urlopen(request, data, timeout)
+            code, msg = response.getcode(), "OK"
+        except urllib2.HTTPError as e:
+            response, code, msg = e, e.code, e.msg
+        body = response.read()
+        headers = str(response.info())
+        response.close()
+        record = {"key": request_key(request, data),
+                  "url": full_url(request),
+                  "code": code,
+                  "msg": msg,
+                  "headers": headers,
+                  "body": base64.b64encode(body),
+                  "elapsed": round(time.time()-start, 4)}
+        with self.lock:
+            f = gzip.open(self.archive, "ab")
+            try:
+                f.write(json.dumps(record)+"\n")
+            finally:
+                f.close()
+        return make_response(record, body)
+
+    def replay(self, request, data, timeout):
+        """
+        Return the archived response to `request`, after the
+        simulated latency.  If the latency exceeds `timeout`, we wait
+        `timeout` seconds, then raise socket.timeout.
+        """
+        try:
+            record = self.records[request_key(request, data)]
+        except KeyError:
+            raise ReplayMiss("Not in archive: %s" % full_url(request))
+        if self.latency == RECORDED:
+            delay = record["elapsed"]
+        else:
+            delay = self.latency or 0
+        if (timeout is not socket._GLOBAL_DEFAULT_TIMEOUT and
+            timeout is not None and delay > timeout):
+            time.sleep(timeout)
+            raise socket.timeout("timed out")
+        if delay:
+            time.sleep(delay)
+        return make_response(record, base64.b64decode(record["body"]))
+
+
+def full_url(request):
+    """
+    Return the URL of `request`, a URL or urllib2.Request.
+    """
+    if isinstance(request, urllib2.Request):
+        return request.get_full_url()
+    return request
+
+def request_key(request, data=None):
+    """
+    Return the key identifying `request` (with body `data`) in an
+    archive.
+    """
+    if isinstance(request, urllib2.Request) and data is None:
+        data = request.get_data()
+    method = "GET" if data is None else "POST"
+    return hashlib.sha1(
+        "%s %s\n%s" % (method, full_url(request), data or "")).hexdigest()
+
+def make_response(record, body):
+    """
+    Return a file-like response for the archived `record`, with the
+    given `body`, as `urllib2.urlopen` would.  Error responses are
+    raised as urllib2.HTTPError.
+    """
+    headers = mimetools.Message(StringIO(record["headers"]))
+    if record["code"] >= 400:
+        raise urllib2.HTTPError(record["url"], record["code"],
+                                record["msg"], headers, StringIO(body))
+    return urllib.addinfourl(StringIO(body), headers, record["url"],
+                             record["code"])
+
+def load_archive(archive):
+    """
+    Return a dict mapping request keys to records from the file
+    `archive`.  Later records for a request replace earlier ones.
+    """
+    records = {}
+    f = gzip.open(archive, "rb")
+    try:
+        for line in f:
+            record = json.loads(line)
+            records[record["key"]] = record
+    finally:
+        f.close()
+    return records
+
+
+#### The transport in use
+_transport = Transport()
+
+def install(transport):
+    """
+    Use `transport` for all subsequent requests.
+    """
+    global _transport
+    _transport = transport
+
+def current():
+    """
+    Return the transport in use.
+    """
+    return _transport
+
+def urlopen(request, data=None, timeout=None):
+    """
+    Open `request` using the transport in use.  See
+    `Transport.urlopen`.
+    """
+    return _transport.urlopen(request, data, timeout)
+
+def from_spec(spec):
+    """
+    Return a Transport described by `spec`, in the format of the
+    `MINI_QA_TRANSPORT` environment variable.
+    """
+    parts = spec.split(":")
+    mode = parts[0]
+    archive = parts[1] if len(parts) > 1 else None
+    latency = None
+    if len(parts) > 2:
+        latency = RECORDED if parts[2] == RECORDED else float(parts[2])
+    return Transport(mode, archive, latency)
+
+if os.getenv("MINI_QA_TRANSPORT"):
+    install(from_spec(os.getenv("MINI_QA_TRANSPORT")))
@@ -19,10 +19,11 @@
 __author__ = 'derik66@gmail.com'
 __version__ = '1.1-devel'
 
-import urllib2
 from xml.dom import minidom
 import simplejson as json
 
+import transport
+
 class WolframAlphaEngine:
 
   def __init__(self, appid='', server=''):
@@ -43,10 +44,10 @@ class WolframAlphaEngine:
     waeq.ToURL()
     return waeq.Query
 
-  def PerformQuery(self, query=''):
+  def PerformQuery(self, query='', timeout=None):
 
     try:
-      result = urllib2.urlopen(self.server, query)
+      result = transport.urlopen(self.server, query, timeout)
       result = result.read()
     except:
       result = '<error>urllib2.urlopen ' + self.server + ' ' + query + '</error>'
@@ -0,0 +1,155 @@
+"""
+wolfram_client.py
+~~~~~~~~~~~~~~~~~
+
+A lean client for the Wolfram Alpha API, built on `wolfram.py`.  A
+single WolframClient holds one WolframAlphaEngine, and reuses it for
+every query.  Queries ask only for the plaintext format of the pods,
+and are subject to both server-side timeouts (`scantimeout`,
+`podtimeout` and `formattimeout`) and a client-side timeout on the
+HTTP request.
+
+Unlike `WolframAlphaEngine.PerformQuery`, failures are not swallowed.
+They raise a WolframError (usually a subclass), whose `retryable`
+attribute says whether the query is worth retrying.
+"""
+
+# Standard library
+import socket
+import time
+import urllib
+import urllib2
+from xml.etree import ElementTree
+
+# My libraries
+import transport
+import wolfram
+
+
+class WolframError(Exception):
+    """
+    Base class for errors raised when querying Wolfram Alpha.
+    """
+    retryable = False
+
+class WolframTimeout(WolframError):
+    """
+    The request to Wolfram Alpha timed out on our side.
+    """
+    retryable = True
+
+class WolframHTTPError(WolframError):
+    """
+    The request to Wolfram Alpha failed, either with an HTTP error
+    status, or at the network level.  Server errors, rate limiting
+    and network failures are retryable, other client errors are not.
+    """
+    def __init__(self, message, code=None):
+        WolframError.__init__(self, message)
+        self.code = code
+        self.retryable = (code is None) or (code >= 500) or (code == 429)
+
+class WolframAPIError(WolframError):
+    """
+    Wolfram Alpha answered, but reported an error (for example, an
+    invalid appid).  Not retryable.
+    """
+    def __init__(self, message, code=None):
+        WolframError.__init__(self, message)
+        self.code = code
+
+
+class WolframClient():
+    """
+    Queries Wolfram Alpha using a single, reusable
+    WolframAlphaEngine.  `scan_timeout`, `pod_timeout` and
+    `format_timeout` are passed on to the Wolfram Alpha server, while
+    `timeout` bounds how long we wait for the HTTP request.  All are
+    in seconds.  Retryable failures are retried up to `retries` times,
+    pausing `retry_pause` seconds between attempts.
+    """
+
+    def __init__(self, appid, server, scan_timeout=3.0, pod_timeout=4.0,
+                 format_timeout=2.0, timeout=10.0, retries=1,
+                 retry_pause=0.5):
+        self.engine = wolfram.WolframAlphaEngine(appid, server)
+        self.engine.ScanTimeout = str(scan_timeout)
+        self.engine.PodTimeout = str(pod_timeout)
+        self.engine.FormatTimeout = str(format_timeout)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_pause = retry_pause
+
+    def query(self, question, timeout=None):
+        """
+        Return the XML document Wolfram Alpha returns for `question`,
+        as a string.  `timeout` is an optional total time budget in
+        seconds for the query, including any retries.  Raises a
+        WolframError on failure.
+        """
+        if isinstance(question, unicode):
+            question = question.encode("utf-8")
+        query = self.engine.CreateQuery(urllib.quote_plus(question))
+        # There's no way to ask for just the primary pod, so we ask
+        # for every pod, but only in plain text
+        query += "&format=plaintext"
+        deadline = None if timeout is None else time.time() + timeout
+        for attempt in range(self.retries+1):
+            attempt_timeout = self.timeout
+            if deadline is not None:
+                attempt_timeout = min(attempt_timeout, deadline-time.time())
+                if attempt_timeout <= 0:
+                    raise WolframTimeout("Query time budget exhausted")
+            try:
+                return self.perform_query(query, attempt_timeout)
+            except WolframError as e:
+                if not e.retryable or attempt == self.retries:
+                    raise
+                if (deadline is not None and
+                    time.time() + self.retry_pause >= deadline):
+                    raise
+                time.sleep(self.retry_pause)
+
+    def perform_query(self, query, timeout=None):
+        """
+        Send the already-built `query` to the server, and return the
+        resulting XML document.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            response = transport.urlopen(self.engine.server, query, timeout)
+            try:
+                result = response.read()
+            finally:
+                response.close()
+        except transport.ReplayMiss as e:
+            # Replaying again can't help
+            raise WolframError(str(e.reason))
+        except urllib2.HTTPError as e:
+            raise WolframHTTPError(str(e), e.code)
+        except urllib2.URLError as e:
+            if isinstance(e.reason, socket.timeout):
+                raise WolframTimeout(str(e.reason))
+            raise WolframHTTPError(str(e.reason))
+        except socket.timeout as e:
+            raise WolframTimeout(str(e))
+        except (socket.error, IOError) as e:
+            raise WolframHTTPError(str(e))
+        check_result(result)
+        return result
+
+
+def check_result(result):
+    """
+    Raise a WolframAPIError if the XML document `result` reports an
+    error.
+    """
+    try:
+        root = ElementTree.fromstring(result)
+    except ElementTree.ParseError as e:
+        raise WolframAPIError("Malformed result: %s" % e)
+    if root.attrib.get("error") == "true":
+        code = root.findtext("error/code")
+        raise WolframAPIError(root.findtext("error/msg") or "Unknown error",
+                              int(code) if code else None)